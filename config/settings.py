@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'drf_yasg',
@@ -173,6 +174,10 @@ if CACHE_ENABLED:
         }
     }
 
+# Seconds a cached page of the public habits feed lives, and how long others wait while one request rebuilds it
+PUBLIC_FEED_CACHE_TIMEOUT = int(os.getenv('PUBLIC_FEED_CACHE_TIMEOUT', 300))
+PUBLIC_FEED_CACHE_LOCK_TIMEOUT = 5
+
 CORS_ALLOWED_ORIGINS = [
     'http://localhost:8000',  # Замените на адрес фронтенд-сервера
 ]
@@ -187,10 +192,72 @@ CORS_ALLOW_ALL_ORIGINS = False
 CELERY_BROKER_URL = 'redis://redis:6379/0'
 CELERY_RESULT_BACKEND = 'redis://redis:6379/0'
 
+# Redis shared by the web and worker processes, e.g. for metrics
+REDIS_URL = os.getenv('REDIS_URL') or CELERY_BROKER_URL
+
+# Bearer token the metrics scraper sends to /metrics/, which is closed while it is unset
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+TELEGRAM_URL = os.getenv('TELEGRAM_URL')
+TELEGRAM_API_TOKEN = os.getenv('TELEGRAM_API_TOKEN')
+# Messages per second for the whole worker fleet, 0 disables the limit
+TELEGRAM_RATE_LIMIT = int(os.getenv('TELEGRAM_RATE_LIMIT', 30))
+# Concurrent requests per worker process
+TELEGRAM_MAX_CONNECTIONS = int(os.getenv('TELEGRAM_MAX_CONNECTIONS', 10))
+
+# Number of due habits handled by one delivery subtask
+REMINDER_CHUNK_SIZE = int(os.getenv('REMINDER_CHUNK_SIZE', 500))
+
+# Seconds a dispatcher holds the lease on its minute
+REMINDER_LEASE_TIMEOUT = int(os.getenv('REMINDER_LEASE_TIMEOUT', 300))
+
+# Minutes after which a missed reminder is dropped instead of being caught up, 0 keeps them all
+REMINDER_STALE_AFTER = int(os.getenv('REMINDER_STALE_AFTER', 60))
+
+# Minutes after which claimed reminders no delivery subtask has handled are dispatched again
+REMINDER_REDISPATCH_AFTER = int(os.getenv('REMINDER_REDISPATCH_AFTER', 10))
+# Minutes a delivery subtask holds the reminders it is sending, after which those of a dead worker are taken again
+REMINDER_SEND_TIMEOUT = int(os.getenv('REMINDER_SEND_TIMEOUT', 15))
+
+# Delivery attempts before a reminder goes to the dead-letter table
+REMINDER_MAX_ATTEMPTS = int(os.getenv('REMINDER_MAX_ATTEMPTS', 5))
+# First retry delay in seconds, doubled on every attempt unless Telegram sends retry_after
+REMINDER_RETRY_BACKOFF = int(os.getenv('REMINDER_RETRY_BACKOFF', 30))
+REMINDER_RETRY_BACKOFF_MAX = int(os.getenv('REMINDER_RETRY_BACKOFF_MAX', 3600))
+
+# Where upcoming reminders are looked up: 'database' (next_due_at index) or 'redis' (sorted set)
+HABIT_SCHEDULER = os.getenv('HABIT_SCHEDULER', 'database')
+HABIT_SCHEDULER_REDIS_URL = os.getenv('HABIT_SCHEDULER_REDIS_URL', CELERY_BROKER_URL)
+
+# Days deletions are kept for delta syncs; older sync tokens get the whole collection again
+HABIT_SYNC_RETENTION = int(os.getenv('HABIT_SYNC_RETENTION', 30))
+# Seconds a sync token reaches back, so rows saved by transactions still running when it was issued aren't missed
+HABIT_SYNC_OVERLAP = 5
+
+# Most operations accepted by one bulk habit request
+HABIT_BULK_MAX_OPERATIONS = int(os.getenv('HABIT_BULK_MAX_OPERATIONS', 1000))
+
+# Rows fetched at a time from the server-side cursor of habit exports
+HABIT_EXPORT_CHUNK_SIZE = int(os.getenv('HABIT_EXPORT_CHUNK_SIZE', 2000))
+
+# Rows validated and written together by habit imports, and row errors reported back
+HABIT_IMPORT_BATCH_SIZE = int(os.getenv('HABIT_IMPORT_BATCH_SIZE', 1000))
+HABIT_IMPORT_MAX_ERRORS = 100
+
 CELERY_BEAT_SCHEDULE = {
     'send_notifications': {
         'task': 'habit.tasks.send_reminder',
         'schedule': crontab(minute='*'),  # Запускать каждую минуту
         'options': {'timezone': 'Europe/Moscow'},
     },
+    'redispatch_reminders': {
+        'task': 'habit.tasks.redispatch_reminders',
+        'schedule': crontab(minute='*/5'),
+        'options': {'timezone': 'Europe/Moscow'},
+    },
+    'prune_habit_tombstones': {
+        'task': 'habit.tasks.prune_habit_tombstones',
+        'schedule': crontab(minute=0, hour=3),
+        'options': {'timezone': 'Europe/Moscow'},
+    },
 }
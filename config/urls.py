@@ -20,6 +20,8 @@ from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
 from rest_framework import permissions
 
+from habit.views import metrics_view
+
 schema_view = get_schema_view(
     openapi.Info(
         title="Habit Hive",
@@ -38,6 +40,7 @@ urlpatterns = [
     path('lms-auth/', include('rest_framework.urls')),
     path('', include('habit.urls', namespace='habit')),
     path('', include('users.urls', namespace='users')),
+    path('metrics/', metrics_view, name='metrics'),
 
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
@@ -1,4 +1,8 @@
 from django.contrib import admin
-from .models import Habit
+from .models import DeadLetter, Habit, HabitTombstone, ReminderDelivery, ReminderTick
 
 admin.site.register(Habit)
+admin.site.register(ReminderTick)
+admin.site.register(ReminderDelivery)
+admin.site.register(DeadLetter)
+admin.site.register(HabitTombstone)
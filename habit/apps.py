@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class HabitConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'habit'
+
+    def ready(self):
+        from habit import signals  # noqa: F401
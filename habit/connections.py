@@ -0,0 +1,14 @@
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+
+
+@lru_cache
+def get_redis_client(url):
+    return redis.Redis.from_url(url)
+
+
+def get_redis():
+    """ Returns the client of the Redis shared by the web and worker processes """
+    return get_redis_client(settings.REDIS_URL)
@@ -0,0 +1,60 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from habit import metrics
+
+GENERATION_KEY = 'habits:public:generation'
+
+
+def get_generation():
+    return cache.get_or_set(GENERATION_KEY, 1, None)
+
+
+def bump_generation():
+    """ Invalidates every cached page of the public feed at once """
+    cache.add(GENERATION_KEY, 1, None)
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
+
+
+def get_page_key(request):
+    """ Cache key of a public feed page: links in the page depend on the host and every query parameter """
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'habits:public:{get_generation()}:{url}'
+
+
+def get_or_build(key, build):
+    """
+    Returns the cached value of `key`, building it with `build()` on a miss.
+
+    Only one caller rebuilds an expired key; the others wait for its result for up to
+    PUBLIC_FEED_CACHE_LOCK_TIMEOUT seconds instead of all hitting the database at once.
+    """
+    value = cache.get(key)
+    if value is not None:
+        metrics.inc('public_feed_cache_hits_total')
+        return value
+
+    metrics.inc('public_feed_cache_misses_total')
+    lock_key = f'{key}:lock'
+    timeout = settings.PUBLIC_FEED_CACHE_LOCK_TIMEOUT
+
+    if not cache.add(lock_key, True, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            value = cache.get(key)
+            if value is not None:
+                return value
+
+    try:
+        value = build()
+        cache.set(key, value, settings.PUBLIC_FEED_CACHE_TIMEOUT)
+    finally:
+        cache.delete(lock_key)
+    return value
@@ -0,0 +1,152 @@
+import codecs
+import csv
+import json
+import time
+from dataclasses import dataclass, field
+from itertools import islice
+
+from django.conf import settings
+
+from habit.models import Habit
+from habit.serializers import HabitBulkItemSerializer, validate_batch_actions
+from habit.services import apply_habit_operations
+
+FORMATS = ('csv', 'ndjson')
+
+
+@dataclass
+class ImportReport:
+    """ Outcome of a habit import; only the first HABIT_IMPORT_MAX_ERRORS row errors are kept """
+    rows: int = 0
+    created: int = 0
+    failed: int = 0
+    elapsed: float = 0
+    errors: list = field(default_factory=list)
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0
+
+    def as_dict(self):
+        return {'rows': self.rows, 'created': self.created, 'failed': self.failed,
+                'rows_per_second': round(self.rows_per_second), 'errors': self.errors}
+
+
+class RowError(ValueError):
+    """ Row that could not be read from the file """
+
+
+class DecodedLines:
+    """
+    Iterates over the lines of a binary stream decoded as UTF-8, keeping the number of the last line read
+    and the numbers of the lines that could not be decoded
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.line = 0
+        self.invalid = set()
+
+    def __iter__(self):
+        for self.line, raw in enumerate(self.stream, start=1):
+            if self.line == 1 and raw.startswith(codecs.BOM_UTF8):
+                raw = raw[len(codecs.BOM_UTF8):]
+            try:
+                yield raw.decode()
+            except UnicodeDecodeError:
+                self.invalid.add(self.line)
+                yield raw.decode(errors='replace')
+
+
+def read_rows(stream, fmt):
+    """
+    Yields (line, data) of the habits in a binary stream of CSV with a header row or of NDJSON,
+    decoding it as it is read. Empty CSV cells are left out, so that the field defaults apply.
+    Rows that can't be decoded or parsed are yielded as a RowError, and the rest of the file is still read.
+    """
+    lines = DecodedLines(stream)
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        while True:
+            first_line = lines.line + 1
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as error:
+                yield lines.line, RowError(f'Invalid CSV: {error}.')
+                continue
+            if lines.invalid.intersection(range(first_line, lines.line + 1)):
+                yield lines.line, RowError('Invalid UTF-8.')
+            else:
+                yield lines.line, {name: value for name, value in row.items() if name and value not in ('', None)}
+    else:
+        for text in lines:
+            if lines.line in lines.invalid:
+                yield lines.line, RowError('Invalid UTF-8.')
+                continue
+            if not text.strip():
+                continue
+            try:
+                data = json.loads(text)
+            except ValueError:
+                data = RowError('Invalid JSON.')
+            yield lines.line, data
+
+
+def import_habits(user, rows, batch_size=None, progress=None):
+    """
+    Creates the user's habits from (line, data) rows, one batch and transaction at a time. Rows failing
+    validation are reported and skipped, the others are written with bulk_create.
+
+    Every batch loads its related habits with one in_bulk and checks its actions with one query;
+    `progress(report)` is called after each batch.
+    """
+    batch_size = batch_size or settings.HABIT_IMPORT_BATCH_SIZE
+    report = ImportReport()
+    started = time.perf_counter()
+    rows = iter(rows)
+
+    while batch := list(islice(rows, batch_size)):
+        related_ids = set()
+        for _, data in batch:
+            if isinstance(data, dict):
+                try:
+                    related_ids.add(int(data['related_habit']))
+                except (KeyError, TypeError, ValueError):
+                    pass
+        habits = Habit.objects.in_bulk(related_ids)
+
+        results = []
+        for line, data in batch:
+            result = {'op': 'create', 'line': line}
+            if isinstance(data, RowError):
+                result['errors'] = {'non_field_errors': [str(data)]}
+            elif not isinstance(data, dict):
+                result['errors'] = {'non_field_errors': ['Expected an object.']}
+            else:
+                serializer = HabitBulkItemSerializer(data=data, context={'habits': habits})
+                if serializer.is_valid():
+                    result['serializer'] = serializer
+                else:
+                    result['errors'] = serializer.errors
+            results.append(result)
+        validate_batch_actions(results)
+
+        created = apply_habit_operations(
+            user, creates=[result['serializer'].validated_data for result in results if 'errors' not in result],
+            updates=[], deletes=[],
+        )
+
+        report.rows += len(batch)
+        report.created += len(created)
+        for result in results:
+            if 'errors' in result:
+                report.failed += 1
+                if len(report.errors) < settings.HABIT_IMPORT_MAX_ERRORS:
+                    report.errors.append({'line': result['line'], 'errors': result['errors']})
+        report.elapsed = time.perf_counter() - started
+        if progress is not None:
+            progress(report)
+
+    return report
@@ -0,0 +1,134 @@
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings, setup_databases, teardown_databases
+from django.utils import timezone
+
+from config.celery import app as celery_app
+from habit.connections import get_redis
+from habit.models import Habit
+from habit.tasks import send_reminder
+from habit.telegram_stub import TelegramStub
+
+
+class Command(BaseCommand):
+    """
+       Load benchmark of the reminder pipeline.
+       python manage.py bench_reminders [--users 1000 10000 100000] [--habits-per-user 1] [--slots 10]
+                                        [--latency 0.05] [--throttle-rate 0.01] [--error-rate 0.01]
+                                        [--max-tick-seconds 60] [--max-queries 1000]
+                                        [--redis-url redis://localhost:6379/15]
+
+       For every number of users the command creates a throwaway test database, seeds the users and their
+       habits spread across `--slots` consecutive minutes and runs send_reminder once per minute with a fake
+       clock. Celery runs eagerly in this process and Telegram is a local stub server with the given latency
+       and share of 429/5xx answers. Per-tick wall time, queries, messages per second and the peak of the
+       memory allocated during the tick (traced with tracemalloc, which slows the ticks down) are reported.
+
+       The Django cache is replaced with a local memory one and the reminders are looked up in the database.
+       Dispatch leases and metrics go to the Redis at --redis-url, which must not be the production one.
+
+       With --max-tick-seconds or --max-queries the command fails when any tick exceeds the limit, so it can
+       be used as a regression gate.
+       """
+    help = 'Benchmark the reminder pipeline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--habits-per-user', type=int, default=1)
+        parser.add_argument('--slots', type=int, default=10, help='Minutes the habits are spread across')
+        parser.add_argument('--latency', type=float, default=0.05, help='Seconds the stub takes to answer')
+        parser.add_argument('--throttle-rate', type=float, default=0, help='Share of 429 answers')
+        parser.add_argument('--error-rate', type=float, default=0, help='Share of 500 answers')
+        parser.add_argument('--max-tick-seconds', type=float)
+        parser.add_argument('--max-queries', type=int)
+        parser.add_argument('--redis-url', default='redis://localhost:6379/15',
+                            help='Redis for the dispatch leases and metrics of the run')
+
+    def handle(self, *args, **options):
+        celery_app.conf.task_always_eager = True
+        failures = []
+
+        self.stdout.write(f'{"users":>8} {"habits":>8} {"tick":>4} {"due":>6} {"sent":>6} {"wall, s":>8} '
+                          f'{"queries":>7} {"msg/s":>8} {"peak, MiB":>9}')
+
+        tracemalloc.start()
+        for users in options['users']:
+            old_config = setup_databases(verbosity=0, interactive=False)
+            try:
+                with TelegramStub(options['latency'], options['throttle_rate'], options['error_rate'],
+                                  retry_after=0) as stub, \
+                        override_settings(TELEGRAM_URL=stub.url, TELEGRAM_API_TOKEN='bench', TELEGRAM_RATE_LIMIT=0,
+                                          REMINDER_RETRY_BACKOFF=0, HABIT_SCHEDULER='database',
+                                          REDIS_URL=options['redis_url'],
+                                          CACHES={'default': {
+                                              'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+                    failures += self.run_scale(users, stub, options)
+            finally:
+                teardown_databases(old_config, verbosity=0)
+        tracemalloc.stop()
+
+        if failures:
+            raise CommandError('Regression gate failed:\n' + '\n'.join(failures))
+
+    def run_scale(self, users, stub, options):
+        start = timezone.now().replace(second=0, microsecond=0) + timedelta(days=1)
+        # Dispatch leases of the previous scale's ticks must not block this one
+        leases = list(get_redis().scan_iter('reminders:dispatch:*'))
+        if leases:
+            get_redis().delete(*leases)
+        habits = self.seed(users, options['habits_per_user'], options['slots'], start)
+        failures = []
+
+        for tick in range(options['slots']):
+            current_time = start + timedelta(minutes=tick)
+            hits = stub.hits
+
+            tracemalloc.reset_peak()
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                send_reminder(current_time.isoformat())
+                wall = time.perf_counter() - started
+            # Peak of the memory allocated by Python during this tick
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+
+            due = Habit.objects.filter(deliveries__scheduled_at=current_time).count()
+            sent = Habit.objects.filter(deliveries__scheduled_at=current_time,
+                                        deliveries__sent_at__isnull=False).count()
+            messages = stub.hits - hits
+            self.stdout.write(f'{users:>8} {habits:>8} {tick:>4} {due:>6} {sent:>6} {wall:>8.2f} '
+                              f'{len(queries):>7} {messages / wall:>8.0f} {peak:>9.1f}')
+
+            if options['max_tick_seconds'] is not None and wall > options['max_tick_seconds']:
+                failures.append(f'{users} users, tick {tick}: {wall:.2f}s > {options["max_tick_seconds"]}s')
+            if options['max_queries'] is not None and len(queries) > options['max_queries']:
+                failures.append(f'{users} users, tick {tick}: {len(queries)} queries > {options["max_queries"]}')
+
+        return failures
+
+    def seed(self, users, habits_per_user, slots, start):
+        """ Creates the users and their habits, due in turn in each of the `slots` minutes from `start` """
+        user_model = get_user_model()
+        batch_size = 5000
+
+        for first in range(0, users, batch_size):
+            user_model.objects.bulk_create([
+                user_model(email=f'user{number}@example.com', telegram=str(number), password='!')
+                for number in range(first, min(first + batch_size, users))
+            ])
+        user_ids = list(user_model.objects.order_by('pk').values_list('pk', flat=True))
+
+        total = users * habits_per_user
+        for first in range(0, total, batch_size):
+            Habit.objects.bulk_create([
+                Habit(user_id=user_ids[number % users], action=f'habit {number}', place='home',
+                      time=timezone.localtime(start + timedelta(minutes=number % slots)).time(),
+                      start_from=start.date(),
+                      next_due_at=start + timedelta(minutes=number % slots))
+                for number in range(first, min(first + batch_size, total))
+            ])
+        return total
@@ -0,0 +1,71 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand
+from django.test.utils import setup_databases, teardown_databases
+from rest_framework.renderers import JSONRenderer
+
+from habit.models import Habit
+from habit.serializers import HabitSerializer, HabitValuesSerializer
+
+
+class Command(BaseCommand):
+    """
+       Micro-benchmark of the habit list serialization.
+       python manage.py bench_serializers [--page-sizes 5 20 100 1000] [--repeat 20]
+
+       Seeds a throwaway test database and, for every page size, loads and renders a page of habits to JSON
+       with HabitSerializer over model instances (as the list views did) and with HabitValuesSerializer over
+       `.values()` rows. Rows per second are the best of `--repeat` runs and include the queries.
+       """
+    help = 'Benchmark the habit list serializers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-sizes', type=int, nargs='+', default=[5, 20, 100, 1000])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            self.seed(max(options['page_sizes']))
+            self.stdout.write(f'{"page":>6} {"instances, rows/s":>18} {"values, rows/s":>15} {"speedup":>8}')
+
+            for page_size in options['page_sizes']:
+                queryset = Habit.objects.order_by('pk')[:page_size]
+                instances = self.measure(lambda: HabitSerializer(queryset.all(), many=True).data,
+                                         options['repeat'])
+                values = self.measure(
+                    lambda: HabitValuesSerializer(queryset.values(*HabitValuesSerializer.values_fields),
+                                                  many=True).data,
+                    options['repeat']
+                )
+                self.stdout.write(f'{page_size:>6} {page_size / instances:>18.0f} {page_size / values:>15.0f} '
+                                  f'{instances / values:>7.1f}x')
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+    @staticmethod
+    def measure(serialize, repeat):
+        """ Best wall time of loading, serializing and rendering a page """
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            JSONRenderer().render(serialize())
+            timings.append(time.perf_counter() - started)
+        return min(timings)
+
+    @staticmethod
+    def seed(habits):
+        """ Creates `habits` habits of as many users, a third with a reward and a third linked to another """
+        users = get_user_model().objects.bulk_create([
+            get_user_model()(email=f'user{number}@example.com', password='!') for number in range(habits)
+        ])
+        created = Habit.objects.bulk_create([
+            Habit(user=users[number], action=f'habit {number}', time='08:00', place='home',
+                  reward='tea' if number % 3 == 1 else None)
+            for number in range(habits)
+        ])
+        for number, habit in enumerate(created):
+            if number % 3 == 2:
+                habit.related_habit = created[number - 2]
+        Habit.objects.bulk_update(created, ['related_habit'])
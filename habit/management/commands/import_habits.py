@@ -0,0 +1,48 @@
+import os
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+
+from habit.importer import FORMATS, import_habits, read_rows
+
+
+class Command(BaseCommand):
+    """
+       Imports habits for a user from a CSV (with a header row) or NDJSON file.
+       python manage.py import_habits <path> --user <email> [--as csv|ndjson] [--batch-size N]
+
+       The file is read as it is imported and written in batches, each in its own transaction. Rows failing
+       validation are reported and skipped; the format defaults to the file's extension.
+       """
+    help = 'Import habits from a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--user', required=True, help='Email of the habits owner')
+        parser.add_argument('--as', dest='format', choices=FORMATS)
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'User {options["user"]} does not exist')
+
+        fmt = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if fmt not in FORMATS:
+            raise CommandError(f'Unknown format {fmt!r}, use --as {"/".join(FORMATS)}')
+
+        with open(options['path'], 'rb') as stream:
+            report = import_habits(user, read_rows(stream, fmt), options['batch_size'], progress=self.show_progress)
+
+        for error in report.errors:
+            self.stderr.write(f'line {error["line"]}: {error["errors"]}')
+        if report.failed > len(report.errors):
+            self.stderr.write(f'... and {report.failed - len(report.errors)} more failed rows')
+        self.stdout.write(self.style.SUCCESS(
+            f'{report.created} habits imported, {report.failed} rows failed, {report.rows_per_second:.0f} rows/s'
+        ))
+
+    def show_progress(self, report):
+        self.stdout.write(f'{report.rows} rows, {report.created} created, {report.failed} failed, '
+                          f'{report.rows_per_second:.0f} rows/s')
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from habit.scheduler import get_scheduler
+
+
+class Command(BaseCommand):
+    """
+       Reseeds the reminder scheduler from the database.
+       python manage.py rebuild_reminder_schedule
+
+       Run it after the Redis sorted set was flushed or when switching HABIT_SCHEDULER to 'redis'.
+       The database scheduler keeps no state, so there is nothing to rebuild for it.
+       """
+    help = 'Rebuild the reminder schedule'
+
+    def handle(self, *args, **options):
+        count = get_scheduler().rebuild()
+        self.stdout.write(self.style.SUCCESS(f'{count} habits scheduled ({settings.HABIT_SCHEDULER} scheduler)'))
@@ -0,0 +1,37 @@
+from django.core.management import BaseCommand
+
+from habit.models import DeadLetter
+from habit.tasks import retry_reminder
+
+
+class Command(BaseCommand):
+    """
+       Re-enqueues undelivered reminders from the dead-letter table.
+       python manage.py replay_dead_letters [--limit N] [--dry-run]
+
+       Every replayed reminder gets a fresh set of delivery attempts and is removed from the table;
+       if it keeps failing it lands there again.
+       """
+    help = 'Replay reminders from the dead-letter table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, help='Replay at most this many reminders, oldest first')
+        parser.add_argument('--dry-run', action='store_true', help='Only show how many reminders would be replayed')
+
+    def handle(self, *args, **options):
+        dead_letters = DeadLetter.objects.order_by('pk')
+        if options['limit']:
+            dead_letters = dead_letters[:options['limit']]
+        dead_letters = list(dead_letters.values_list('pk', 'habit_id', 'habit_ids', 'delivery_ids', 'chat_id', 'text'))
+
+        if options['dry_run']:
+            self.stdout.write(f'{len(dead_letters)} reminders would be replayed')
+            return
+
+        for pk, habit_id, habit_ids, delivery_ids, chat_id, text in dead_letters:
+            # Dead letters written before habit_ids was added only know their first habit
+            habit_ids = habit_ids or ([habit_id] if habit_id else [])
+            retry_reminder.delay(habit_ids, chat_id, text, 1, delivery_ids)
+        DeadLetter.objects.filter(pk__in=[pk for pk, *rest in dead_letters]).delete()
+
+        self.stdout.write(self.style.SUCCESS(f'{len(dead_letters)} reminders replayed'))
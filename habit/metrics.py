@@ -0,0 +1,85 @@
+from habit.connections import get_redis
+
+PREFIX = 'metrics:'
+
+# Upper bounds of histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LAG_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 900, 3600)
+
+COUNTERS = {
+    'reminders_due_total': 'Reminders claimed for delivery',
+    'reminders_sent_total': 'Reminders delivered',
+    'reminders_failed_total': 'Reminders whose first delivery attempt failed',
+    'reminders_retried_total': 'Reminders re-enqueued for another attempt',
+    'reminders_dead_lettered_total': 'Reminder messages moved to the dead-letter table',
+    'reminders_stale_total': 'Missed reminders dropped as too old',
+    'telegram_messages_total': 'Messages posted to the Telegram API',
+    'public_feed_cache_hits_total': 'Public habits feed pages served from the cache',
+    'public_feed_cache_misses_total': 'Public habits feed pages built from the database',
+}
+
+GAUGES = {
+    'reminders_slot_due': 'Reminders due in the last dispatched slot',
+    'reminders_backlog_seconds': 'Age of the oldest due reminder when the last tick started',
+    'reminders_due_scan_seconds': 'Time the last tick spent scanning and claiming due reminders',
+    'reminders_tick_duration_seconds': 'Time from the start of the last finished slot to its last delivery',
+    'reminders_last_tick_timestamp_seconds': 'Start of the last dispatched slot',
+}
+
+HISTOGRAMS = {
+    'telegram_send_seconds': ('Latency of Telegram sendMessage calls', LATENCY_BUCKETS),
+    'reminders_lag_seconds': ('Delay between the scheduled and the actual send time', LAG_BUCKETS),
+}
+
+
+def inc(name, value=1):
+    """ Increments a counter """
+    # Metrics live in the shared Redis, so every web and worker process adds to the same values
+    if value:
+        get_redis().incrby(f'{PREFIX}{name}', value)
+
+
+def set_gauge(name, value):
+    get_redis().set(f'{PREFIX}{name}', value)
+
+
+def observe(name, values):
+    """ Records observations (in seconds) in a histogram with one round trip """
+    values = list(values)
+    if not values:
+        return
+
+    buckets = HISTOGRAMS[name][1]
+    pipeline = get_redis().pipeline(transaction=False)
+    for bound in buckets:
+        pipeline.incrby(f'{PREFIX}{name}:{bound}', sum(1 for value in values if value <= bound))
+    pipeline.incrby(f'{PREFIX}{name}:count', len(values))
+    pipeline.incrbyfloat(f'{PREFIX}{name}:sum', sum(values))
+    pipeline.execute()
+
+
+def render():
+    """ Returns all metrics in the Prometheus text exposition format """
+    keys = [f'{PREFIX}{name}' for name in (*COUNTERS, *GAUGES)]
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        keys += [f'{PREFIX}{name}:{bound}' for bound in (*buckets, 'count', 'sum')]
+    values = dict(zip(keys, get_redis().mget(keys)))
+
+    def value(key):
+        stored = values.get(f'{PREFIX}{key}')
+        return stored.decode() if stored is not None else 0
+
+    lines = []
+    for kind, metrics in (('counter', COUNTERS), ('gauge', GAUGES)):
+        for name, help_text in metrics.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value(name)}']
+
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        # Every bucket counts all observations up to its bound, as Prometheus expects
+        lines += [f'{name}_bucket{{le="{bound}"}} {value(f"{name}:{bound}")}' for bound in buckets]
+        lines += [f'{name}_bucket{{le="+Inf"}} {value(f"{name}:count")}',
+                  f'{name}_sum {value(f"{name}:sum")}',
+                  f'{name}_count {value(f"{name}:count")}']
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:30
+
+from django.db import migrations, models
+from django.utils import timezone
+
+from habit.recurrence import next_occurrence
+
+
+def backfill_next_due_at(apps, schema_editor):
+    Habit = apps.get_model('habit', 'Habit')
+    now = timezone.now()
+    batch = []
+
+    for habit in Habit.objects.only('pk', 'start_from', 'time', 'frequency').iterator(chunk_size=2000):
+        habit.next_due_at = next_occurrence(habit.start_from, habit.time, habit.frequency, after=now)
+        batch.append(habit)
+        if len(batch) == 2000:
+            Habit.objects.bulk_update(batch, ['next_due_at'])
+            batch = []
+
+    Habit.objects.bulk_update(batch, ['next_due_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habit', '0002_alter_habit_options_alter_habit_action_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='habit',
+            name='next_due_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Next Reminder'),
+        ),
+        migrations.RunPython(backfill_next_due_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='habit',
+            index=models.Index(condition=models.Q(('is_learned', False)), fields=['next_due_at'], name='habit_next_due_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habit', '0003_habit_next_due_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReminderTick',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.DateTimeField(verbose_name='Slot')),
+                ('due', models.PositiveIntegerField(default=0, verbose_name='Due')),
+                ('sent', models.PositiveIntegerField(default=0, verbose_name='Sent')),
+                ('failed', models.PositiveIntegerField(default=0, verbose_name='Failed')),
+                ('started_at', models.DateTimeField(auto_now_add=True, verbose_name='Started At')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finished At')),
+            ],
+            options={
+                'verbose_name': 'Reminder Tick',
+                'verbose_name_plural': 'Reminder Ticks',
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habit', '0004_remindertick'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='remindertick',
+            name='retried',
+            field=models.PositiveIntegerField(default=0, verbose_name='Retried'),
+        ),
+        migrations.CreateModel(
+            name='DeadLetter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.CharField(max_length=150, verbose_name='Chat ID')),
+                ('text', models.TextField(verbose_name='Text')),
+                ('attempts', models.PositiveSmallIntegerField(verbose_name='Attempts')),
+                ('status', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Last Status')),
+                ('error', models.TextField(blank=True, verbose_name='Last Error')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('habit', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='dead_letters', to='habit.habit', verbose_name='Habit')),
+            ],
+            options={
+                'verbose_name': 'Dead Letter',
+                'verbose_name_plural': 'Dead Letters',
+            },
+        ),
+    ]
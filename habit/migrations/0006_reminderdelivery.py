@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habit', '0005_deadletter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReminderDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scheduled_at', models.DateTimeField(verbose_name='Scheduled At')),
+                ('claim', models.UUIDField(db_index=True, verbose_name='Claim')),
+                ('claimed_at', models.DateTimeField(auto_now_add=True, verbose_name='Claimed At')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Sent At')),
+                ('habit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='habit.habit', verbose_name='Habit')),
+            ],
+            options={
+                'verbose_name': 'Reminder Delivery',
+                'verbose_name_plural': 'Reminder Deliveries',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='reminderdelivery',
+            constraint=models.UniqueConstraint(fields=('habit', 'scheduled_at'), name='unique_habit_reminder_slot'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:38
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habit', '0006_reminderdelivery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='remindertick',
+            name='backlog',
+            field=models.DurationField(default=datetime.timedelta, verbose_name='Backlog'),
+        ),
+        migrations.AddField(
+            model_name='remindertick',
+            name='stale',
+            field=models.PositiveIntegerField(default=0, verbose_name='Dropped as Stale'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:05
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+import django.db.models.functions.text
+
+SEARCH_VECTOR = """
+    setweight(to_tsvector('pg_catalog.english', coalesce({row}action, '')), 'A') ||
+    setweight(to_tsvector('pg_catalog.english', coalesce({row}place, '')), 'B') ||
+    setweight(to_tsvector('pg_catalog.english', coalesce({row}description, '')), 'C')
+"""
+
+CREATE_TRIGGER = f"""
+CREATE FUNCTION habit_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {SEARCH_VECTOR.format(row='NEW.')};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER habit_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF action, place, description ON habit_habit
+    FOR EACH ROW EXECUTE FUNCTION habit_search_vector_update();
+
+UPDATE habit_habit SET search_vector = {SEARCH_VECTOR.format(row='')};
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER habit_search_vector_trigger ON habit_habit;
+DROP FUNCTION habit_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habit', '0009_habittombstone'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='habit',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Search Vector'),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.AddIndex(
+            model_name='habit',
+            index=django.contrib.postgres.indexes.GinIndex(condition=models.Q(('is_public', True)), fields=['search_vector'], name='habit_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='habit',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Lower('action'), name='text_pattern_ops'), condition=models.Q(('is_public', True)), name='habit_action_prefix_idx'),
+        ),
+    ]
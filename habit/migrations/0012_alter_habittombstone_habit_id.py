@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habit', '0011_habit_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='habittombstone',
+            name='habit_id',
+            field=models.PositiveBigIntegerField(verbose_name='Habit ID'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habit', '0012_alter_habittombstone_habit_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reminderdelivery',
+            name='failed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Failed At'),
+        ),
+        migrations.AddIndex(
+            model_name='reminderdelivery',
+            index=models.Index(condition=models.Q(('failed_at__isnull', True), ('sent_at__isnull', True)), fields=['claimed_at'], name='delivery_unhandled_idx'),
+        ),
+    ]
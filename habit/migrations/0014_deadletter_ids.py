@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:24
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habit', '0013_reminderdelivery_failed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deadletter',
+            name='delivery_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), blank=True, default=list, size=None, verbose_name='Delivery IDs'),
+        ),
+        migrations.AddField(
+            model_name='deadletter',
+            name='habit_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), blank=True, default=list, size=None, verbose_name='Habit IDs'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habit', '0014_deadletter_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reminderdelivery',
+            name='sending_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Sending Until'),
+        ),
+    ]
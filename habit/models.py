@@ -1,5 +1,14 @@
+import zoneinfo
+from datetime import timedelta
+
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.functions import Lower
+from django.utils import timezone
 
+from habit.recurrence import next_occurrence
 from users.models import User
 
 
@@ -17,10 +26,147 @@ class Habit(models.Model):
     is_learned = models.BooleanField(default=False, verbose_name='Is Learned')
     reward = models.CharField(max_length=255, null=True, blank=True, verbose_name='Reward')
     is_public = models.BooleanField(default=False, verbose_name='Is Public')
+    next_due_at = models.DateTimeField(null=True, blank=True, editable=False, verbose_name='Next Reminder')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Updated At')
+    # Weighted action, place and description, kept up to date by a database trigger (see migration 0010)
+    search_vector = SearchVectorField(null=True, editable=False, verbose_name='Search Vector')
 
     def __str__(self):
         return self.action
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered to tell whether a save changes what the public feed shows
+        instance.was_public = instance.is_public if 'is_public' in field_names else None
+        return instance
+
+    def get_next_due_at(self, after=None):
+        """
+        Returns the next reminder moment after `after` (now by default) in the user's time zone.
+        Users with a daily digest get reminders of all their habits at the digest time.
+        """
+        tz = zoneinfo.ZoneInfo(self.user.timezone)
+        return next_occurrence(
+            start_from=self.start_from or timezone.localdate(timezone=tz),
+            time=self.user.digest_time or self._meta.get_field('time').to_python(self.time),
+            frequency=self.frequency,
+            after=after or timezone.now(),
+            tz=tz,
+        )
+
+    def save(self, *args, **kwargs):
+        # A cleared schedule is recomputed, e.g. on creation or after the habit's time has changed
+        if self.next_due_at is None:
+            self.next_due_at = self.get_next_due_at()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'next_due_at'}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'Habit'
         verbose_name_plural = 'Habits'
+        indexes = [
+            models.Index(fields=['next_due_at'], condition=models.Q(is_learned=False), name='habit_next_due_idx'),
+            # The public feed and a user's habits are both read in pk order, a page at a time
+            models.Index(fields=['id'], condition=models.Q(is_public=True), name='habit_public_pk_idx'),
+            models.Index(fields=['user', 'id'], name='habit_user_pk_idx'),
+            models.Index(fields=['user', 'updated_at'], name='habit_user_updated_idx'),
+            GinIndex(fields=['search_vector'], condition=models.Q(is_public=True), name='habit_search_idx'),
+            # Prefix autocomplete of public actions: LIKE 'prefix%' on a pattern ops index is a range scan
+            models.Index(OpClass(Lower('action'), name='text_pattern_ops'), condition=models.Q(is_public=True),
+                         name='habit_action_prefix_idx'),
+        ]
+
+
+class HabitTombstone(models.Model):
+    """ Record of a deleted habit, so that delta syncs can tell clients to remove it """
+    # Written while the owner itself may be being deleted, so without a database constraint
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+',
+                             verbose_name='User')
+    habit_id = models.PositiveBigIntegerField(verbose_name='Habit ID')
+    deleted_at = models.DateTimeField(default=timezone.now, verbose_name='Deleted At')
+
+    def __str__(self):
+        return f'{self.habit_id} @ {self.deleted_at:%Y-%m-%d %H:%M}'
+
+    class Meta:
+        verbose_name = 'Habit Tombstone'
+        verbose_name_plural = 'Habit Tombstones'
+        indexes = [
+            models.Index(fields=['user', 'deleted_at'], name='tombstone_user_deleted_idx'),
+        ]
+
+
+class ReminderTick(models.Model):
+    """ Totals of one reminder dispatch run """
+    slot = models.DateTimeField(verbose_name='Slot')
+    due = models.PositiveIntegerField(default=0, verbose_name='Due')
+    sent = models.PositiveIntegerField(default=0, verbose_name='Sent')
+    failed = models.PositiveIntegerField(default=0, verbose_name='Failed')
+    retried = models.PositiveIntegerField(default=0, verbose_name='Retried')
+    stale = models.PositiveIntegerField(default=0, verbose_name='Dropped as Stale')
+    backlog = models.DurationField(default=timedelta, verbose_name='Backlog')  # age of the oldest due reminder
+    started_at = models.DateTimeField(auto_now_add=True, verbose_name='Started At')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Finished At')
+
+    def __str__(self):
+        return f'{self.slot:%Y-%m-%d %H:%M}'
+
+    class Meta:
+        verbose_name = 'Reminder Tick'
+        verbose_name_plural = 'Reminder Ticks'
+
+
+class ReminderDelivery(models.Model):
+    """ Ledger entry claiming one scheduled reminder of a habit, so it is sent only once """
+    habit = models.ForeignKey(Habit, on_delete=models.CASCADE, related_name='deliveries', verbose_name='Habit')
+    scheduled_at = models.DateTimeField(verbose_name='Scheduled At')
+    claim = models.UUIDField(db_index=True, verbose_name='Claim')
+    claimed_at = models.DateTimeField(auto_now_add=True, verbose_name='Claimed At')
+    # Lease of the delivery subtask sending the reminder, so that it sends outside of a transaction
+    sending_until = models.DateTimeField(null=True, blank=True, verbose_name='Sending Until')
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name='Sent At')
+    # Set when the first attempt failed and the reminder went on to retries or to the dead-letter table
+    failed_at = models.DateTimeField(null=True, blank=True, verbose_name='Failed At')
+
+    def __str__(self):
+        return f'{self.habit_id} @ {self.scheduled_at:%Y-%m-%d %H:%M}'
+
+    @property
+    def lag(self):
+        """ Delay between the scheduled and the actual send time """
+        return self.sent_at - self.scheduled_at if self.sent_at else None
+
+    class Meta:
+        verbose_name = 'Reminder Delivery'
+        verbose_name_plural = 'Reminder Deliveries'
+        constraints = [
+            models.UniqueConstraint(fields=['habit', 'scheduled_at'], name='unique_habit_reminder_slot'),
+        ]
+        indexes = [
+            models.Index(fields=['claimed_at'], condition=models.Q(sent_at__isnull=True, failed_at__isnull=True),
+                         name='delivery_unhandled_idx'),
+        ]
+
+
+class DeadLetter(models.Model):
+    """ Reminder that could not be delivered after all attempts """
+    habit = models.ForeignKey(Habit, on_delete=models.SET_NULL, null=True, blank=True, related_name='dead_letters',
+                              verbose_name='Habit')
+    # All habits of a coalesced message and their ledger entries, so that a replay can mark them sent
+    habit_ids = ArrayField(models.BigIntegerField(), default=list, blank=True, verbose_name='Habit IDs')
+    delivery_ids = ArrayField(models.BigIntegerField(), default=list, blank=True, verbose_name='Delivery IDs')
+    chat_id = models.CharField(max_length=150, verbose_name='Chat ID')
+    text = models.TextField(verbose_name='Text')
+    attempts = models.PositiveSmallIntegerField(verbose_name='Attempts')
+    status = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name='Last Status')
+    error = models.TextField(blank=True, verbose_name='Last Error')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Created At')
+
+    def __str__(self):
+        return f'{self.chat_id}: {self.text}'
+
+    class Meta:
+        verbose_name = 'Dead Letter'
+        verbose_name_plural = 'Dead Letters'
@@ -1,7 +1,82 @@
-from rest_framework.pagination import PageNumberPagination
+from django.core import signing
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class HabitCursorPaginator(CursorPagination):
+    """ Keyset pagination by pk: every page is an index seek, without COUNT(*) or OFFSET """
+    page_size = 5
+    page_size_query_param = 'page_size'
+    max_page_size = 20
+    ordering = 'pk'
 
 
 class HabitPaginator(PageNumberPagination):
+    """
+    Page number pagination, or cursor pagination when the request asks for it
+    with `?pagination=cursor` or carries a `cursor`.
+    """
     page_size = 5
     page_size_query_param = 'page_size'
     max_page_size = 20
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get('pagination') == 'cursor' or 'cursor' in request.query_params:
+            self.cursor_paginator = HabitCursorPaginator()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class HabitSearchPaginator(BasePagination):
+    """
+    Keyset pagination of ranked search results by (rank desc, pk): the next page's cursor signs the position
+    of the last result, so deep pages cost as much as the first.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    cursor_salt = 'habit.search'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.page_size
+        try:
+            page_size = min(int(request.query_params[self.page_size_query_param]), self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        page_size = max(page_size, 1)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            try:
+                rank, pk = signing.loads(cursor, salt=self.cursor_salt)
+            except (signing.BadSignature, TypeError, ValueError):
+                raise NotFound('Invalid cursor')
+            queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, pk__gt=pk))
+
+        results = list(queryset.order_by('-rank', 'pk')[:page_size + 1])
+        self.next_position = None
+        if len(results) > page_size:
+            results = results[:page_size]
+            last = results[-1]
+            self.next_position = (last['rank'], last['pk']) if isinstance(last, dict) else (last.rank, last.pk)
+        return results
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param,
+                                   signing.dumps(self.next_position, salt=self.cursor_salt))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
@@ -0,0 +1,27 @@
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+
+def next_occurrence(start_from, time, frequency, after, tz=None):
+    """
+    Returns the first moment later than `after` at which a habit fires.
+
+    A habit fires at `time` (wall clock in `tz`) on `start_from` and then every `frequency` days.
+    """
+    tz = tz or timezone.get_current_timezone()
+    frequency = max(frequency or 1, 1)
+    after_local = timezone.localtime(after, tz)
+
+    day = max(start_from or after_local.date(), after_local.date())
+    # Align the day with the habit's cycle
+    if start_from:
+        offset = (day - start_from).days % frequency
+        if offset:
+            day += timedelta(days=frequency - offset)
+
+    candidate = timezone.make_aware(datetime.combine(day, time), tz)
+    while candidate <= after:
+        day += timedelta(days=frequency)
+        candidate = timezone.make_aware(datetime.combine(day, time), tz)
+    return candidate
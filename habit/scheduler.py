@@ -0,0 +1,131 @@
+from django.conf import settings
+
+from habit.connections import get_redis_client
+from habit.models import Habit
+
+POP_DUE_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #ids > 0 then
+    redis.call('ZREM', KEYS[1], unpack(ids))
+end
+return ids
+"""
+
+
+class DatabaseScheduler:
+    """ Finds due habits with a range scan on the `next_due_at` index every tick """
+
+    def get_due_batches(self, habits, current_time, size):
+        """ Yields lists of (habit id, next due at, chat id) rows of the due `habits` """
+        batch, last_user_id = [], None
+        rows = habits.values_list('pk', 'next_due_at', 'user__telegram', 'user_id').iterator(chunk_size=size)
+        for habit_id, next_due_at, chat_id, user_id in rows:
+            # A batch is never cut between two habits of the same user, unless they have no chat to share
+            if len(batch) >= size and (user_id != last_user_id or not chat_id):
+                yield batch
+                batch = []
+            batch.append((habit_id, next_due_at, chat_id))
+            last_user_id = user_id
+        if batch:
+            yield batch
+
+    def schedule(self, habits):
+        pass
+
+    def unschedule(self, habit_ids):
+        pass
+
+    def rebuild(self):
+        return 0
+
+
+class RedisScheduler:
+    """
+    Keeps the next reminder time of every active habit in a Redis sorted set.
+
+    A tick pops only the members whose score is in the past, so it costs O(due) instead of O(habits).
+    A batch may hold more than `size` habits, as it is completed with the other due habits of its users.
+    """
+    key = 'reminders:schedule'
+
+    def __init__(self, client):
+        self.client = client
+        self.pop_due = client.register_script(POP_DUE_SCRIPT)
+
+    def get_due_batches(self, habits, current_time, size):
+        """ Yields lists of (habit id, next due at, chat id) rows of the due `habits` """
+        while True:
+            habit_ids = [int(habit_id) for habit_id in
+                         self.pop_due(keys=[self.key], args=[current_time.timestamp(), size])]
+            if not habit_ids:
+                return
+
+            # Members are popped in score order, so the batch takes all due habits of the popped habits' users
+            # along, and a chat's reminders are never split between batches
+            batch = list(habits.filter(
+                user_id__in=habits.filter(pk__in=habit_ids).values('user_id')
+            ).values_list('pk', 'next_due_at', 'user__telegram'))
+            batch_ids = {habit_id for habit_id, next_due_at, chat_id in batch}
+            taken = batch_ids.difference(habit_ids)
+            if taken:
+                self.unschedule(list(taken))
+            # Members with an outdated score go back into the set
+            popped = set(habit_ids).difference(batch_ids)
+            if popped:
+                self.schedule(Habit.objects.filter(pk__in=popped).only('pk', 'next_due_at', 'is_learned'))
+            if batch:
+                yield batch
+
+    def schedule(self, habits, key=None):
+        """ Puts active habits into the set at their next reminder time and drops learned ones """
+        key = key or self.key
+        active, learned = {}, []
+        for habit in habits:
+            if habit.is_learned or habit.next_due_at is None:
+                learned.append(habit.pk)
+            else:
+                active[habit.pk] = habit.next_due_at.timestamp()
+
+        pipeline = self.client.pipeline()
+        if active:
+            pipeline.zadd(key, active)
+        if learned:
+            pipeline.zrem(key, *learned)
+        pipeline.execute()
+
+    def unschedule(self, habit_ids):
+        if habit_ids:
+            self.client.zrem(self.key, *habit_ids)
+
+    def rebuild(self, batch_size=5000):
+        """ Reseeds the set from the database, returns the number of scheduled habits """
+        # The new set is built aside and swapped in, so ticks keep working during the rebuild
+        rebuild_key = f'{self.key}:rebuild'
+        self.client.delete(rebuild_key)
+        count = 0
+        batch = []
+
+        habits = Habit.objects.filter(is_learned=False, next_due_at__isnull=False).only(
+            'pk', 'next_due_at', 'is_learned')
+        for habit in habits.iterator(chunk_size=batch_size):
+            batch.append(habit)
+            if len(batch) == batch_size:
+                self.schedule(batch, rebuild_key)
+                count += len(batch)
+                batch = []
+
+        self.schedule(batch, rebuild_key)
+        count += len(batch)
+
+        if count:
+            self.client.rename(rebuild_key, self.key)
+        else:
+            self.client.delete(self.key)
+        return count
+
+
+def get_scheduler():
+    """ Returns the reminder scheduler backend selected by the HABIT_SCHEDULER setting """
+    if settings.HABIT_SCHEDULER == 'redis':
+        return RedisScheduler(get_redis_client(settings.HABIT_SCHEDULER_REDIS_URL))
+    return DatabaseScheduler()
@@ -4,7 +4,17 @@ from habit.models import Habit
 from . import validators
 
 
-class HabitSerializer(serializers.ModelSerializer):
+class SelectableFieldsMixin:
+    """ Takes an optional `fields` collection and leaves only those fields in the representation """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class HabitSerializer(SelectableFieldsMixin, serializers.ModelSerializer):
     frequency = serializers.IntegerField(default=1)
     estimated_time = serializers.IntegerField(default=120)
     user = serializers.SlugRelatedField(slug_field="email", read_only=True)
@@ -33,11 +43,12 @@ class HabitSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
+        # Read from the instance, as a field selection may leave either field out
         # If related_habit is filled, remove reward
-        if representation['related_habit']:
+        if instance.related_habit_id:
             representation.pop('reward', None)
         # If reward is filled, remove related_habit
-        elif representation['reward']:
+        elif instance.reward:
             representation.pop('related_habit', None)
         # If both fields are empty, remove them from the view
         else:
@@ -47,15 +58,137 @@ class HabitSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Habit
-        fields = '__all__'
+        # The reminder schedule changes every time a reminder is sent, it isn't part of the listed habit
+        exclude = ['next_due_at', 'search_vector']
         validators = [validators.RelatedHabitValidator('related_habit'),
                       validators.LearnedHabitValidator('related_habit', 'is_learned', 'reward'),
                       validators.RelatedHabitAndRewardValidator('related_habit', 'reward'),
                       validators.TimeSequenceValidator('related_habit', 'time')]
 
 
-class HabitDetailSerializer(serializers.ModelSerializer):
+class BulkRelatedHabitField(serializers.PrimaryKeyRelatedField):
+    """ Takes related habits from the `habits` map in the context, loaded for a whole bulk request at once """
+
+    def to_internal_value(self, data):
+        # Like PrimaryKeyRelatedField, JSON booleans aren't ids even though int() takes them
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            habit = self.context['habits'].get(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if habit is None:
+            self.fail('does_not_exist', pk_value=data)
+        return habit
+
+
+class HabitBulkItemSerializer(HabitSerializer):
+    """
+    HabitSerializer for one operation of a bulk request. It runs no queries: related habits come
+    from the context and the uniqueness of actions is checked for the whole request by the view.
+    """
+    related_habit = BulkRelatedHabitField(queryset=Habit.objects.none(), required=False, allow_null=True)
+
+    class Meta(HabitSerializer.Meta):
+        extra_kwargs = {'action': {'validators': []}}
+
+    def validate(self, data):
+        data = super().validate(data)
+        # An update is checked as the habit it will become, not just the changed fields
+        if self.instance is not None:
+            habit = {name: getattr(self.instance, name) for name in ('related_habit', 'reward', 'is_learned', 'time')}
+            habit.update(data)
+            for validator in self.Meta.validators:
+                validator(habit)
+        return data
+
+
+def validate_batch_actions(results):
+    """
+    Actions are unique: checks those of a batch of HabitBulkItemSerializer results against each other and
+    the stored habits with a single query, and a habit is the target of one operation at most. Results are
+    dicts with the operation's `op`, the `serializer` of valid ones, the `target` habit of updates and deletes,
+    and get `errors` added.
+    """
+    targeted = set()
+    for result in results:
+        if 'target' in result:
+            if result['target'].pk in targeted:
+                result.setdefault('errors', {})['id'] = ['The habit is already changed by this request.']
+            targeted.add(result['target'].pk)
+
+    deleted = {result['target'].pk for result in results if result['op'] == 'delete' and 'target' in result}
+    pending = [result for result in results if 'serializer' in result]
+
+    for result in pending:
+        related_habit = result['serializer'].validated_data.get('related_habit')
+        if related_habit is not None and related_habit.pk in deleted:
+            result.setdefault('errors', {})['related_habit'] = ['The related habit is deleted by this request.']
+
+    claims = {}
+    for result in pending:
+        action = result['serializer'].validated_data.get('action')
+        if action is not None:
+            claims.setdefault(action, []).append(result)
+    owners = dict(Habit.objects.filter(action__in=claims).exclude(pk__in=deleted).values_list('action', 'pk'))
+
+    # Within the batch the first claim of an action wins
+    for action, claimants in claims.items():
+        owner = owners.get(action)
+        for index, result in enumerate(claimants):
+            if index or (owner is not None and owner != getattr(result.get('target'), 'pk', None)):
+                result.setdefault('errors', {})['action'] = ['Habit with this Action already exists.']
+
+
+class HabitDetailSerializer(SelectableFieldsMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Habit
-        fields = '__all__'
+        exclude = ['search_vector']
+
+
+class HabitValuesSerializer(serializers.BaseSerializer):
+    """
+    Read-only HabitSerializer for lists: turns `.values(*get_values_fields(fields))` rows into the same
+    representation without building model instances or running field machinery per row.
+    """
+    # Representation field -> `.values()` column, in HabitSerializer's order
+    columns = {'id': 'pk', 'frequency': 'frequency', 'estimated_time': 'estimated_time', 'user': 'user__email',
+               'action': 'action', 'time': 'time', 'place': 'place', 'start_from': 'start_from',
+               'description': 'description', 'is_learned': 'is_learned', 'reward': 'reward',
+               'is_public': 'is_public', 'updated_at': 'updated_at', 'related_habit': 'related_habit'}
+    values_fields = list(columns.values())
+    datetime_field = serializers.DateTimeField()
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.plan = [(name, column) for name, column in self.columns.items() if fields is None or name in fields]
+        formatters = {
+            'time': lambda value: value.isoformat(),
+            'start_from': lambda value: value.isoformat(),
+            'updated_at': self.datetime_field.to_representation,
+        }
+        self.formatters = [(name, formatters[name]) for name, _ in self.plan if name in formatters]
+
+    @classmethod
+    def get_values_fields(cls, fields=None):
+        """ Columns to load for the selected fields, plus the pk cursors page by and what the pruning reads """
+        if fields is None:
+            return cls.values_fields
+        names = {*fields, 'id', 'related_habit', 'reward'}
+        return [column for name, column in cls.columns.items() if name in names]
+
+    def to_representation(self, row):
+        representation = {name: row[column] for name, column in self.plan}
+        for name, formatter in self.formatters:
+            representation[name] = formatter(representation[name])
+
+        # Same pruning as HabitSerializer: only one of related_habit and reward is shown
+        if row['related_habit']:
+            representation.pop('reward', None)
+        elif row['reward']:
+            representation.pop('related_habit', None)
+        else:
+            representation.pop('related_habit', None)
+            representation.pop('reward', None)
+        return representation
@@ -1,32 +1,253 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
 
-from django.db.models import F, DateTimeField, Case, When
+from django.conf import settings
+from django.core import signing
+from django.db import router, transaction
+from django.db.models.deletion import Collector
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, FloatField, Max, Min, Q
+from django.db.models.functions import Cast, Lower
 from django.utils import timezone
-from .models import Habit
-
-
-def get_habits_due_now(user):
-    """
-    Returns a queryset of Habit objects that are due to be performed now.
-    """
-    current_time = timezone.localtime(timezone.now())
-
-    habit_list = Habit.objects.filter(
-        user=user,
-        start_from__lte=current_time.date(),
-        time__hour=current_time.hour,
-        time__minute=current_time.minute,
-        is_learned=False,
-    ).annotate(
-        new_date=Case(
-            When(frequency=1, then=F('start_from') + timedelta(days=1)),
-            When(frequency=2, then=F('start_from') + timedelta(days=2)),
-            When(frequency=3, then=F('start_from') + timedelta(days=3)),
-            When(frequency=4, then=F('start_from') + timedelta(days=4)),
-            When(frequency=5, then=F('start_from') + timedelta(days=5)),
-            When(frequency=6, then=F('start_from') + timedelta(days=6)),
-            When(frequency=7, then=F('start_from') + timedelta(days=7)),
-            output_field=DateTimeField()
-        )
+from .feed_cache import bump_generation
+from .models import Habit, HabitTombstone, ReminderDelivery
+from .scheduler import get_scheduler
+from users.models import User
+
+
+def get_due_habits(current_time=None):
+    """
+    Returns a queryset of habits whose reminder is due, across all users.
+
+    The filter is a range scan on the `next_due_at` index.
+    """
+    if current_time is None:
+        current_time = timezone.now()
+
+    # Habits of the same user go together, so their reminders can share a message
+    return Habit.objects.filter(next_due_at__lte=current_time, is_learned=False).order_by('user_id', 'pk')
+
+
+def get_reminder_backlog(current_time=None):
+    """
+    Returns how far behind the reminders are: the age of the oldest reminder still waiting to be sent.
+    """
+    if current_time is None:
+        current_time = timezone.now()
+
+    oldest = get_due_habits(current_time).aggregate(oldest=Min('next_due_at'))['oldest']
+    return current_time - oldest if oldest else timedelta(0)
+
+
+def claim_due_reminders(claim, current_time=None, size=500, stale_before=None):
+    """
+    Claims the reminders due now in the delivery ledger and moves the habits to their next occurrence.
+
+    Every reminder missed since the last run is still due, so a late tick catches up on the whole
+    window in one pass. Reminders scheduled before `stale_before` are too old to be useful: their
+    habits are moved on without a ledger entry.
+
+    Due habits come from the scheduler backend in batches of `size`; each batch is claimed with one
+    bulk insert, and reminders already claimed by an overlapping run are skipped by the ledger's
+    unique constraint. Yields an inclusive (first id, last id) range of ledger entries for every batch.
+    """
+    if current_time is None:
+        current_time = timezone.now()
+
+    for batch in get_scheduler().get_due_batches(get_due_habits(current_time), current_time, size):
+        ReminderDelivery.objects.bulk_create([
+            ReminderDelivery(habit_id=habit_id, scheduled_at=scheduled_at, claim=claim)
+            for habit_id, scheduled_at, chat_id in batch
+            # There is nowhere to deliver a reminder without a chat id
+            if chat_id and (stale_before is None or scheduled_at >= stale_before)
+        ], ignore_conflicts=True)
+        schedule_next_reminders([habit_id for habit_id, scheduled_at, chat_id in batch], current_time)
+
+        claimed = ReminderDelivery.objects.filter(
+            claim=claim, habit_id__in=[habit_id for habit_id, scheduled_at, chat_id in batch],
+        ).aggregate(first_id=Min('pk'), last_id=Max('pk'))
+        if claimed['first_id'] is not None:
+            yield claimed['first_id'], claimed['last_id']
+
+
+def get_claimed_reminders(claim, id_range, current_time=None):
+    """
+    Returns (ledger id, habit id, action, chat id, digest time, scheduled at) rows of the reminders
+    in a claimed range that were neither sent nor handed to retries, and no delivery subtask is sending.
+    """
+    if current_time is None:
+        current_time = timezone.now()
+
+    return ReminderDelivery.objects.filter(
+        Q(sending_until__isnull=True) | Q(sending_until__lt=current_time),
+        claim=claim,
+        pk__range=id_range,
+        sent_at__isnull=True,
+        failed_at__isnull=True,
+    ).order_by('pk').values_list('pk', 'habit_id', 'habit__action', 'habit__user__telegram',
+                                 'habit__user__digest_time', 'scheduled_at')
+
+
+def get_unhandled_reminder_ranges(claimed_before, size=500, stale_before=None, current_time=None):
+    """
+    Yields (claim, first id, last id) ranges of at most `size` reminders claimed before `claimed_before`
+    that no delivery subtask has handled, e.g. because the dispatcher or a worker died in between.
+    Reminders scheduled before `stale_before` are left alone, and so are those a subtask is still sending.
+    """
+    if current_time is None:
+        current_time = timezone.now()
+
+    unhandled = ReminderDelivery.objects.filter(
+        Q(sending_until__isnull=True) | Q(sending_until__lt=current_time),
+        claimed_at__lt=claimed_before, sent_at__isnull=True, failed_at__isnull=True,
     )
-    return habit_list
+    if stale_before is not None:
+        unhandled = unhandled.filter(scheduled_at__gte=stale_before)
+
+    claim, ids = None, []
+    for row_claim, pk in unhandled.order_by('claim', 'pk').values_list('claim', 'pk').iterator(chunk_size=size):
+        if ids and (row_claim != claim or len(ids) == size):
+            yield str(claim), ids[0], ids[-1]
+            ids = []
+        claim = row_claim
+        ids.append(pk)
+    if ids:
+        yield str(claim), ids[0], ids[-1]
+
+
+def reschedule_user_habits(user):
+    """
+    Recomputes the next reminder of all the user's habits, e.g. after the user's time zone
+    or digest time has changed.
+    """
+    schedule_next_reminders(list(user.habits.values_list('pk', flat=True)))
+
+
+def schedule_next_reminders(habit_ids, after=None):
+    """
+    Moves the next reminder of the given habits to their first occurrence after `after`.
+    """
+    habits = list(Habit.objects.filter(pk__in=habit_ids).select_related('user').only(
+        'pk', 'start_from', 'time', 'frequency', 'is_learned', 'user__timezone', 'user__digest_time'))
+    for habit in habits:
+        habit.next_due_at = habit.get_next_due_at(after)
+    Habit.objects.bulk_update(habits, ['next_due_at'])
+    get_scheduler().schedule(habits)
+
+
+SYNC_TOKEN_SALT = 'habit.sync'
+
+
+def make_sync_token(user, moment):
+    """ Signed token of the moment up to which the user's client has synced """
+    return signing.dumps({'user': user.pk, 'since': moment.isoformat()}, salt=SYNC_TOKEN_SALT)
+
+
+def read_sync_token(user, token):
+    """
+    Returns the moment stored in the token, or None when it is older than the kept deletions
+    and the client has to sync everything again. Raises signing.BadSignature for foreign or forged tokens.
+    """
+    data = signing.loads(token, salt=SYNC_TOKEN_SALT)
+    if data.get('user') != user.pk:
+        raise signing.BadSignature('Sync token of another user')
+    since = datetime.fromisoformat(data['since'])
+    if since < timezone.now() - timedelta(days=settings.HABIT_SYNC_RETENTION):
+        return None
+    return since
+
+
+def get_habit_changes(user, since=None):
+    """
+    Returns the user's habits changed after `since` and the ids of the habits deleted since then,
+    everything and no deletions without `since`.
+    """
+    habits = Habit.objects.filter(user=user).order_by('pk')
+    if since is None:
+        return habits, []
+    deleted = HabitTombstone.objects.filter(user=user, deleted_at__gt=since).values_list('habit_id', flat=True)
+    return habits.filter(updated_at__gt=since), list(deleted)
+
+
+def apply_habit_operations(user, creates, updates, deletes):
+    """
+    Applies validated bulk operations on the user's habits in one transaction: `creates` are validated data,
+    `updates` (habit, validated data) pairs and `deletes` habits. Returns the created habits.
+
+    Bulk writes don't send the save signals and deletes are flagged for the delete receivers to skip them,
+    so the scheduling, tombstone, feed and collection version updates they would make are done here once
+    for the whole request.
+    """
+    now = timezone.now()
+    public = False
+
+    with transaction.atomic():
+        # Deletes go first, so the other operations may take over their actions
+        if deletes:
+            deleted_ids = [habit.pk for habit in deletes]
+            # Habits linked to the deleted ones lose their related habit without being saved
+            dependents = Habit.objects.filter(related_habit__in=deleted_ids).exclude(pk__in=deleted_ids)
+            dependent_user_ids = set(dependents.values_list('user_id', flat=True))
+            if dependent_user_ids:
+                dependents.update(updated_at=now)
+                User.objects.filter(pk__in=dependent_user_ids - {user.pk}).update(habits_modified_at=now)
+
+            for habit in deletes:
+                habit.bulk_deleted = True
+            collector = Collector(using=router.db_for_write(Habit))
+            collector.collect(deletes)
+            collector.delete()
+
+            HabitTombstone.objects.bulk_create([HabitTombstone(user_id=user.pk, habit_id=habit_id, deleted_at=now)
+                                                for habit_id in deleted_ids])
+            get_scheduler().unschedule(deleted_ids)
+
+        fields = {'updated_at'}
+        for habit, data in updates:
+            public = public or habit.is_public
+            for name, value in data.items():
+                setattr(habit, name, value)
+            if {'time', 'frequency', 'is_learned'} & data.keys():
+                habit.next_due_at = habit.get_next_due_at()
+                fields.add('next_due_at')
+            habit.updated_at = now
+            fields.update(data.keys())
+        updated = [habit for habit, _ in updates]
+        Habit.objects.bulk_update(updated, fields, batch_size=500)
+
+        created = [Habit(user=user, **data) for data in creates]
+        for habit in created:
+            habit.next_due_at = habit.get_next_due_at()
+        created = Habit.objects.bulk_create(created, batch_size=500)
+
+        if created or updated:
+            get_scheduler().schedule(created + updated)
+        if created or updated or deletes:
+            User.objects.filter(pk=user.pk).update(habits_modified_at=now)
+            # Public habits linked to a deleted one lose their related habit, so any deletion counts
+            if deletes or public or any(habit.is_public for habit in created + updated):
+                bump_generation()
+
+    return created
+
+
+# Text search configuration of the habit_search_vector_update trigger
+SEARCH_CONFIG = 'english'
+
+
+def search_public_habits(query):
+    """
+    Public habits matching a web-search style query (`"drink water" -coffee`) over their action, place
+    and description, annotated with their `rank`. The match is served by the partial GIN index.
+    """
+    search_query = SearchQuery(query, search_type='websearch', config=SEARCH_CONFIG)
+    return Habit.objects.filter(is_public=True, search_vector=search_query).annotate(
+        # Double precision, so that ranks survive the round trip through keyset cursors exactly
+        rank=Cast(SearchRank(F('search_vector'), search_query), FloatField())
+    )
+
+
+def autocomplete_public_actions(prefix, limit=10):
+    """ Actions of public habits starting with `prefix`, case-insensitively, in alphabetical order """
+    return list(Habit.objects.filter(is_public=True).annotate(action_lower=Lower('action')).filter(
+        action_lower__startswith=prefix.lower()
+    ).order_by('action_lower').values_list('action', flat=True)[:limit])
@@ -0,0 +1,70 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from habit.feed_cache import bump_generation
+from habit.models import Habit, HabitTombstone
+from habit.scheduler import get_scheduler
+from users.models import User
+
+
+@receiver(post_save, sender=Habit)
+def schedule_habit(sender, instance, **kwargs):
+    """ Keeps the scheduler in step with the habit's next reminder """
+    get_scheduler().schedule([instance])
+
+
+def is_bulk_deleted(instance):
+    """ Habits deleted by apply_habit_operations, which does the work of the delete receivers in bulk """
+    return getattr(instance, 'bulk_deleted', False)
+
+
+@receiver(post_delete, sender=Habit)
+def unschedule_habit(sender, instance, **kwargs):
+    if not is_bulk_deleted(instance):
+        get_scheduler().unschedule([instance.pk])
+
+
+@receiver(post_save, sender=Habit)
+def invalidate_public_feed_on_save(sender, instance, created, **kwargs):
+    """ A public habit (or one that has just stopped being public) changes the cached public feed """
+    was_public = getattr(instance, 'was_public', None)
+    if instance.is_public or was_public or (was_public is None and not created):
+        bump_generation()
+    instance.was_public = instance.is_public
+
+
+@receiver(post_delete, sender=Habit)
+def invalidate_public_feed_on_delete(sender, instance, **kwargs):
+    # Public habits linked to the deleted one lose their related habit, so any deletion counts
+    if not is_bulk_deleted(instance):
+        bump_generation()
+
+
+@receiver(post_save, sender=Habit)
+@receiver(post_delete, sender=Habit)
+def touch_user_habits(sender, instance, **kwargs):
+    """ Moves the version of the owner's habit collection that conditional GETs compare against """
+    if not is_bulk_deleted(instance):
+        User.objects.filter(pk=instance.user_id).update(habits_modified_at=timezone.now())
+
+
+@receiver(post_delete, sender=Habit)
+def record_tombstone(sender, instance, **kwargs):
+    """ Lets delta syncs report the deletion """
+    if not is_bulk_deleted(instance):
+        HabitTombstone.objects.create(user_id=instance.user_id, habit_id=instance.pk)
+
+
+@receiver(pre_delete, sender=Habit)
+def touch_dependent_habits(sender, instance, **kwargs):
+    # The database nulls related_habit of the habits linked to this one without saving them,
+    # stamping them makes them show up in conditional GETs and delta syncs
+    if is_bulk_deleted(instance):
+        return
+    dependents = Habit.objects.filter(related_habit=instance)
+    user_ids = set(dependents.values_list('user_id', flat=True))
+    if user_ids:
+        now = timezone.now()
+        dependents.update(updated_at=now)
+        User.objects.filter(pk__in=user_ids).update(habits_modified_at=now)
@@ -1,31 +1,216 @@
-import os
-
-import requests
+import time
+import uuid
+from datetime import datetime, timedelta
 
 from celery import shared_task
-from django.contrib.auth import get_user_model
-from habit.services import get_habits_due_now
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.template.loader import get_template
+from django.utils import timezone
+
+from habit import metrics
+from habit.connections import get_redis
+from habit.models import DeadLetter, Habit, HabitTombstone, ReminderDelivery, ReminderTick
+from habit.services import (claim_due_reminders, get_claimed_reminders, get_due_habits, get_reminder_backlog,
+                            get_unhandled_reminder_ranges)
+from habit.telegram import get_telegram_client
+
+REMINDER_TEMPLATE = 'habit/reminder.txt'
+
+
+@shared_task
+def send_reminder(now=None):
+    """
+    Claims the reminders due now and delivers them in parallel subtasks.
+    `now` (ISO format) replaces the current time, e.g. when replaying a tick.
+    """
+    current_time = datetime.fromisoformat(now) if now else timezone.now()
+    slot = current_time.replace(second=0, microsecond=0)
+
+    # Only one dispatcher may run per minute, even if beat fires twice or a tick overruns
+    # The lease is taken in the shared Redis, so it holds across beat and worker processes
+    if not get_redis().set(f'reminders:dispatch:{slot.isoformat()}', 1, nx=True, ex=settings.REMINDER_LEASE_TIMEOUT):
+        return
+
+    # Reminders missed by a late or skipped tick are caught up, unless they are too old to be useful
+    stale_before = None
+    stale = 0
+    if settings.REMINDER_STALE_AFTER:
+        stale_before = current_time - timedelta(minutes=settings.REMINDER_STALE_AFTER)
+        stale = get_due_habits(current_time).filter(next_due_at__lt=stale_before).count()
+
+    backlog = get_reminder_backlog(current_time)
+    tick = ReminderTick.objects.create(slot=slot, backlog=backlog, stale=stale)
+    claim = uuid.uuid4()
+
+    scan_started = time.perf_counter()
+    # Every range goes to its delivery subtask as soon as it is claimed; ranges left behind by a crash
+    # are picked up by redispatch_reminders
+    ranges = 0
+    for first_id, last_id in claim_due_reminders(claim, current_time, settings.REMINDER_CHUNK_SIZE, stale_before):
+        deliver_reminders.delay(str(claim), first_id, last_id, tick.pk)
+        ranges += 1
+    due = ReminderDelivery.objects.filter(claim=claim).count()
+
+    metrics.set_gauge('reminders_due_scan_seconds', time.perf_counter() - scan_started)
+    metrics.set_gauge('reminders_slot_due', due)
+    metrics.set_gauge('reminders_backlog_seconds', backlog.total_seconds())
+    metrics.set_gauge('reminders_last_tick_timestamp_seconds', slot.timestamp())
+    metrics.inc('reminders_due_total', due)
+    metrics.inc('reminders_stale_total', stale)
+
+    if not ranges:
+        ReminderTick.objects.filter(pk=tick.pk).update(finished_at=timezone.now())
+
+
+@shared_task(acks_late=True, autoretry_for=(Exception,), retry_backoff=True, retry_backoff_max=600, max_retries=5)
+def deliver_reminders(claim, first_id, last_id, tick_id=None):
+    """
+    Sending a reminder to perform an action for a range of claimed reminders,
+    one message per chat for all of its habits due in the range
+    """
+    # The reminders are leased in a short transaction of their own, so that no transaction or row lock
+    # is held while the messages are sent; a redispatched or retried copy of the range skips them
+    with transaction.atomic():
+        claimed_at = timezone.now()
+        reminders = list(get_claimed_reminders(claim, (first_id, last_id), claimed_at).select_for_update(
+            skip_locked=True, of=('self',)))
+        ReminderDelivery.objects.filter(pk__in=[reminder[0] for reminder in reminders]).update(
+            sending_until=claimed_at + timedelta(minutes=settings.REMINDER_SEND_TIMEOUT))
+
+    chats = {}
+    for delivery_id, habit_id, action, chat_id, digest_time, scheduled_at in reminders:
+        chat = chats.setdefault(chat_id, {'delivery_ids': [], 'habit_ids': [], 'actions': [], 'scheduled': [],
+                                          'digest': False})
+        chat['delivery_ids'].append(delivery_id)
+        chat['scheduled'].append(scheduled_at)
+        chat['habit_ids'].append(habit_id)
+        chat['actions'].append(action)
+        chat['digest'] = digest_time is not None
+
+    template = get_template(REMINDER_TEMPLATE)
+    messages = [(chat_id, render_reminder(chat['actions'], chat['digest'], template))
+                for chat_id, chat in chats.items()]
+    results = get_telegram_client().send_many(messages)
+
+    totals = {'due': sum(len(chat['habit_ids']) for chat in chats.values()), 'sent': 0, 'failed': 0,
+              'retried': 0}
+    sent, failed, scheduled = [], [], []
+    for chat, (chat_id, text), result in zip(chats.values(), messages, results):
+        if result.ok:
+            sent.extend(chat['delivery_ids'])
+            scheduled.extend(chat['scheduled'])
+        else:
+            failed.append((chat, text, result))
+
+    sent_at = timezone.now()
+    with transaction.atomic():
+        ReminderDelivery.objects.filter(pk__in=sent).update(sent_at=sent_at)
+        ReminderDelivery.objects.filter(
+            pk__in=[delivery_id for chat, text, result in failed for delivery_id in chat['delivery_ids']]
+        ).update(failed_at=sent_at)
+    totals['sent'] = len(sent)
+
+    # Retries are enqueued once the failed reminders are marked, so that they never race the marks
+    for chat, text, result in failed:
+        totals['failed'] += len(chat['habit_ids'])
+        if handle_failed_reminder(chat['habit_ids'], text, result, attempt=1, delivery_ids=chat['delivery_ids']):
+            totals['retried'] += len(chat['habit_ids'])
+
+    metrics.inc('telegram_messages_total', len(results))
+    metrics.observe('telegram_send_seconds', [result.elapsed for result in results])
+    metrics.observe('reminders_lag_seconds', [(sent_at - scheduled_at).total_seconds() for scheduled_at in scheduled])
+    metrics.inc('reminders_sent_total', totals['sent'])
+    metrics.inc('reminders_failed_total', totals['failed'])
+    metrics.inc('reminders_retried_total', totals['retried'])
+    if tick_id is not None:
+        record_reminder_tick(tick_id, totals, sent_at)
+    return totals
+
+
+def render_reminder(actions, digest=False, template=None):
+    """
+    Renders the text of a reminder about one or several habits
+    """
+    template = template or get_template(REMINDER_TEMPLATE)
+    return template.render({'actions': actions, 'digest': digest}).strip()
+
+
+@shared_task
+def retry_reminder(habit_ids, chat_id, text, attempt, delivery_ids=None):
+    """
+    Another attempt to deliver a reminder message
+    """
+    result = get_telegram_client().send_message(chat_id, text)
+    metrics.inc('telegram_messages_total')
+    metrics.observe('telegram_send_seconds', [result.elapsed])
+
+    if result.ok:
+        if delivery_ids:
+            ReminderDelivery.objects.filter(pk__in=delivery_ids).update(sent_at=timezone.now())
+        metrics.inc('reminders_sent_total', len(habit_ids))
+    elif handle_failed_reminder(habit_ids, text, result, attempt, delivery_ids):
+        metrics.inc('reminders_retried_total', len(habit_ids))
+
+
+def handle_failed_reminder(habit_ids, text, result, attempt, delivery_ids=None):
+    """
+    Re-enqueues a failed reminder message with backoff or moves it to the dead-letter table.
+    Returns True if another attempt was scheduled.
+    """
+    if result.retryable and attempt < settings.REMINDER_MAX_ATTEMPTS:
+        countdown = result.retry_after or min(settings.REMINDER_RETRY_BACKOFF * 2 ** (attempt - 1),
+                                              settings.REMINDER_RETRY_BACKOFF_MAX)
+        retry_reminder.apply_async((habit_ids, result.chat_id, text, attempt + 1, delivery_ids), countdown=countdown)
+        return True
+
+    # Habits may have been deleted while the reminder was being retried
+    habit = Habit.objects.filter(pk__in=habit_ids).order_by('pk').first()
+    DeadLetter.objects.create(habit=habit, habit_ids=habit_ids, delivery_ids=delivery_ids or [],
+                              chat_id=result.chat_id, text=text, attempts=attempt,
+                              status=result.status, error=result.error or '')
+    metrics.inc('reminders_dead_lettered_total')
+    return False
+
+
+def record_reminder_tick(tick_id, totals, finished_at):
+    """
+    Adds the totals of a delivery subtask to its dispatch run, which is finished when its last subtask is
+    """
+    ReminderTick.objects.filter(pk=tick_id).update(
+        due=F('due') + totals['due'],
+        sent=F('sent') + totals['sent'],
+        failed=F('failed') + totals['failed'],
+        retried=F('retried') + totals['retried'],
+        finished_at=Greatest('finished_at', Value(finished_at)),
+    )
+
+    slot = ReminderTick.objects.values_list('slot', flat=True).get(pk=tick_id)
+    metrics.set_gauge('reminders_tick_duration_seconds', (finished_at - slot).total_seconds())
+
+
+@shared_task
+def redispatch_reminders():
+    """
+    Hands claimed reminders that were never delivered, e.g. after a crash of the dispatcher or of a worker,
+    to new delivery subtasks
+    """
+    current_time = timezone.now()
+    stale_before = None
+    if settings.REMINDER_STALE_AFTER:
+        stale_before = current_time - timedelta(minutes=settings.REMINDER_STALE_AFTER)
+
+    for claim, first_id, last_id in get_unhandled_reminder_ranges(
+            current_time - timedelta(minutes=settings.REMINDER_REDISPATCH_AFTER), settings.REMINDER_CHUNK_SIZE,
+            stale_before, current_time):
+        deliver_reminders.delay(claim, first_id, last_id)
 
 
 @shared_task
-def send_reminder():
-    """
-    Sending a reminder to perform an action
-    """
-    URL = os.getenv('TELEGRAM_URL')
-    TOKEN = os.getenv('TELEGRAM_API_TOKEN')
-
-    # Get habits due now
-    for user in get_user_model().objects.all():
-        habits_due_now = get_habits_due_now(user)
-
-        for habit in habits_due_now:
-            chat_id = user.telegram
-            message = f"It's time to do {habit.action}."
-            try:
-                requests.post(
-                    url=f'{URL}{TOKEN}/sendMessage?chat_id={chat_id}&text={message}'
-                )
-            except requests.exceptions.RequestException as e:
-                # Log the error or handle it as needed
-                print(f"Failed to send message to {chat_id}: {e}")
+def prune_habit_tombstones():
+    """ Deletes tombstones no sync token can ask for any more """
+    HabitTombstone.objects.filter(
+        deleted_at__lt=timezone.now() - timedelta(days=settings.HABIT_SYNC_RETENTION)
+    ).delete()
@@ -0,0 +1,138 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+
+from habit.connections import get_redis
+
+TOKEN_BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate / 1000)
+
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + 1000)
+return wait
+"""
+
+
+class RedisTokenBucket:
+    """ Token bucket shared by every worker through Redis """
+
+    def __init__(self, client, key, rate, capacity=None):
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def acquire(self):
+        """ Blocks until a token is available """
+        while True:
+            wait = self.script(keys=[self.key], args=[self.rate, self.capacity])
+            if not wait:
+                return
+            time.sleep(wait / 1000)
+
+
+@dataclass
+class SendResult:
+    """ Outcome of a single sendMessage call """
+    chat_id: str
+    ok: bool
+    status: int = None
+    retry_after: int = None
+    error: str = None
+    elapsed: float = 0
+
+    @property
+    def retryable(self):
+        """ Network errors, throttling and server errors may succeed on another attempt """
+        return self.status is None or self.status == 429 or self.status >= 500
+
+
+class TelegramClient:
+    """ Telegram Bot API client with a pooled keep-alive session and bounded concurrency """
+
+    def __init__(self, url, token, rate_limiter=None, max_connections=10, timeout=10):
+        self.base_url = f'{url}{token}'
+        self.rate_limiter = rate_limiter
+        self.max_connections = max_connections
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def send_message(self, chat_id, text):
+        """ Sends one message and reports how it went """
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+        started = time.perf_counter()
+        try:
+            response = self.session.post(f'{self.base_url}/sendMessage',
+                                         json={'chat_id': chat_id, 'text': text}, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            return SendResult(chat_id, ok=False, error=str(e), elapsed=time.perf_counter() - started)
+        elapsed = time.perf_counter() - started
+
+        if response.ok:
+            return SendResult(chat_id, ok=True, status=response.status_code, elapsed=elapsed)
+
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        return SendResult(chat_id, ok=False, status=response.status_code,
+                          retry_after=body.get('parameters', {}).get('retry_after'),
+                          error=body.get('description', response.reason), elapsed=elapsed)
+
+    def send_many(self, messages):
+        """ Sends (chat id, text) pairs concurrently, returning results in the same order """
+        with ThreadPoolExecutor(max_workers=self.max_connections) as executor:
+            return list(executor.map(lambda message: self.send_message(*message), messages))
+
+
+_client = None
+
+
+@receiver(setting_changed)
+def reset_telegram_client(setting, **kwargs):
+    """ Drops the cached client when its settings change, e.g. in tests """
+    global _client
+
+    if setting.startswith('TELEGRAM_') or setting == 'REDIS_URL':
+        _client = None
+
+
+def get_telegram_client():
+    """ Returns the client of this worker process, so its connections are reused between tasks """
+    global _client
+
+    if _client is None:
+        rate_limiter = None
+        if settings.TELEGRAM_RATE_LIMIT:
+            rate_limiter = RedisTokenBucket(get_redis(), 'telegram:rate-limit', settings.TELEGRAM_RATE_LIMIT)
+
+        _client = TelegramClient(settings.TELEGRAM_URL, settings.TELEGRAM_API_TOKEN, rate_limiter=rate_limiter,
+                                 max_connections=settings.TELEGRAM_MAX_CONNECTIONS)
+    return _client
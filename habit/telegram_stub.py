@@ -0,0 +1,89 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class TelegramStub:
+    """
+    Local HTTP server mimicking the sendMessage method of the Telegram Bot API.
+
+    Use it as a context manager and point the client at `stub.url`. `latency` delays every answer;
+    statuses queued with `fail_next` are answered before the stub goes back to 200 OK.
+    `throttle_rate` and `error_rate` answer that share of the other requests with 429 (asking to retry
+    after `retry_after` seconds) and 500 respectively.
+    """
+
+    def __init__(self, latency=0, throttle_rate=0, error_rate=0, retry_after=1):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(0)
+        self.messages = []
+        self.failures = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}/bot'
+
+    def fail_next(self, status, count=1, retry_after=None):
+        """ Answers the next `count` requests with an error status """
+        with self.lock:
+            self.failures.extend([(status, retry_after)] * count)
+
+    def _pick_status(self):
+        roll = self.random.random()
+        if roll < self.throttle_rate:
+            return 429, self.retry_after
+        if roll < self.throttle_rate + self.error_rate:
+            return 500, None
+        return 200, None
+
+    @property
+    def hits(self):
+        return len(self.messages)
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                with stub.lock:
+                    stub.messages.append(payload)
+                    status, retry_after = stub.failures.pop(0) if stub.failures else stub._pick_status()
+
+                if status == 200:
+                    body = {'ok': True, 'result': {'chat': {'id': payload.get('chat_id')}, 'text': payload.get('text')}}
+                else:
+                    body = {'ok': False, 'error_code': status, 'description': 'Stub error'}
+                    if retry_after is not None:
+                        body['parameters'] = {'retry_after': retry_after}
+
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
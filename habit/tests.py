@@ -1,9 +1,74 @@
+import json
+import os
+import tempfile
+import uuid
+import zoneinfo
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest import mock
+
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.functions import Lower
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase, APIClient
 
-from habit.models import Habit
+from config.celery import app as celery_app
+from habit.models import DeadLetter, Habit, HabitTombstone, ReminderDelivery, ReminderTick
+from habit.recurrence import next_occurrence
+from habit.scheduler import DatabaseScheduler, RedisScheduler
+from habit.serializers import HabitSerializer, HabitValuesSerializer
+from habit.services import (claim_due_reminders, get_claimed_reminders, get_due_habits,
+                            get_unhandled_reminder_ranges, reschedule_user_habits, schedule_next_reminders,
+                            search_public_habits)
+from habit.tasks import deliver_reminders, redispatch_reminders, render_reminder, retry_reminder, send_reminder
+from habit.telegram import RedisTokenBucket, SendResult, TelegramClient, get_telegram_client
+from habit.telegram_stub import TelegramStub
+
+
+class FakeRedis:
+    """ In-memory stand-in for the shared Redis, with the commands of the metrics and the dispatch lease """
+
+    def __init__(self):
+        self.data = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = str(value).encode()
+        return True
+
+    def incrby(self, key, amount):
+        self.data[key] = str(int(self.data.get(key, 0)) + amount).encode()
+
+    def incrbyfloat(self, key, amount):
+        self.data[key] = str(float(self.data.get(key, 0)) + amount).encode()
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        return []
+
+
+def use_fake_redis(test_case):
+    """ Points the shared Redis client of `test_case` at a new FakeRedis and returns it """
+    redis = FakeRedis()
+    patcher = mock.patch('habit.connections.get_redis_client', return_value=redis)
+    patcher.start()
+    test_case.addCleanup(patcher.stop)
+    return redis
 
 
 class HabitTestCase(APITestCase):
@@ -79,12 +144,199 @@ class HabitTestCase(APITestCase):
         else:
             self.assertEqual(len(response.data['results']), 0)
 
+    def test_public_list_habit_cursor(self):
+        """ Testing the cursor pagination of the public habits list """
+        for number in range(7):
+            Habit.objects.create(user=self.other_user, action=f'public habit {number}', time='10:00',
+                                 place='park', is_public=True)
+
+        response = self.client.get(reverse('habit:public-habit-list'), {'pagination': 'cursor', 'page_size': 5})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        self.assertEqual([habit['action'] for habit in response.data['results']],
+                         ['going to bed before midnight'] + [f'public habit {number}' for number in range(4)])
+
+        response = self.client.get(response.data['next'])
+
+        self.assertEqual([habit['action'] for habit in response.data['results']],
+                         [f'public habit {number}' for number in range(4, 7)])
+        self.assertIsNone(response.data['next'])
+
+    def test_values_serializer_matches_habit_serializer(self):
+        """ Testing that the list serializer renders exactly what HabitSerializer renders """
+        Habit.objects.create(user=self.user, action='reading', time='21:00', place='sofa', reward='tea',
+                             description='ten pages')
+        queryset = Habit.objects.order_by('pk')
+
+        self.assertEqual(
+            JSONRenderer().render(HabitValuesSerializer(queryset.values(*HabitValuesSerializer.values_fields),
+                                                        many=True).data),
+            JSONRenderer().render(HabitSerializer(queryset, many=True).data)
+        )
+
+    def test_list_habit_query_count(self):
+        """ Testing that listing habits doesn't query the user of every habit """
+        for number in range(10):
+            Habit.objects.create(user=self.other_user, action=f'public habit {number}', time='10:00',
+                                 place='park', is_public=True)
+
+        # Count and page
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('habit:public-habit-list'), {'page_size': 20})
+        self.assertEqual(response.data['results'][-1]['user'], 'other@example.com')
+
+    def test_list_habit_fields(self):
+        """ Testing that `?fields=` narrows both the response and the query """
+        Habit.objects.create(user=self.user, action='reading', time='21:00', place='sofa', reward='tea',
+                             description='ten pages')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('habit:habit-list-create'), {'fields': 'action,reward'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # reward is still left out of habits that have a related habit
+        self.assertEqual(response.data['results'], [{'action': 'brushing my teeth'},
+                                                    {'action': 'going to bed before midnight'},
+                                                    {'action': 'reading', 'reward': 'tea'}])
+        self.assertNotIn('description', queries[-1]['sql'])
+
+    def test_read_habit_omit(self):
+        """ Testing that `?omit=` leaves fields out of the habit details """
+        response = self.client.get(reverse('habit:habit', kwargs={'pk': self.new_habit.id}),
+                                   {'omit': 'description,next_due_at'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('description', response.data)
+        self.assertNotIn('next_due_at', response.data)
+        self.assertEqual(response.data['action'], 'going to bed before midnight')
+
+    def test_list_habit_unknown_fields(self):
+        """ Testing that unknown fields are rejected """
+        response = self.client.get(reverse('habit:public-habit-list'), {'fields': 'action,password'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_public_habits(self):
+        """ Testing that public habits are searched by rank and paged by cursor """
+        Habit.objects.create(user=self.user, action='walking', time='19:00', place='park', is_public=True,
+                             description='before going to bed')
+        Habit.objects.create(user=self.user, action='going to bed early', time='21:00', place='bedroom')
+        url = reverse('habit:public-habit-list')
+
+        response = self.client.get(url, {'q': 'going to bed', 'page_size': 1})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([habit['action'] for habit in response.data['results']], ['going to bed before midnight'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([habit['action'] for habit in response.data['results']], ['walking'])
+        self.assertIsNone(response.data['next'])
+
+        response = self.client.get(url, {'q': 'going to bed', 'cursor': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_autocomplete_public_actions(self):
+        """ Testing that public actions are suggested by case-insensitive prefix """
+        Habit.objects.create(user=self.user, action='Going for a walk', time='19:00', place='park', is_public=True)
+        Habit.objects.create(user=self.user, action='going out', time='19:00', place='park')
+
+        response = self.client.get(reverse('habit:public-habit-autocomplete'), {'q': 'GOING'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], ['Going for a walk', 'going to bed before midnight'])
+
+    @override_settings(CACHE_ENABLED=True)
+    def test_public_list_habit_cache(self):
+        """ Testing that public feed pages are cached until a public habit changes """
+        cache.clear()
+        redis = use_fake_redis(self)
+        url = reverse('habit:public-habit-list')
+        self.client.get(url)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.data['results'][0]['action'], 'going to bed before midnight')
+        self.assertEqual(redis.data['metrics:public_feed_cache_hits_total'], b'1')
+
+        # A private habit doesn't touch the feed
+        Habit.objects.create(user=self.user, action='reading', time='21:00', place='sofa')
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        self.new_habit.action = 'going to bed at ten'
+        self.new_habit.save()
+        response = self.client.get(url)
+        self.assertEqual(response.data['results'][0]['action'], 'going to bed at ten')
+
+        # Hiding a habit removes it from the cached feed too
+        habit = Habit.objects.get(pk=self.new_habit.pk)
+        habit.is_public = False
+        habit.save()
+        response = self.client.get(url)
+        self.assertEqual(response.data['count'], 0)
+
     def test_read_habit(self):
         """ Habit viewing test """
         response = self.client.get(reverse('habit:habit', kwargs={'pk': self.new_habit.id}))
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['action'], 'going to bed before midnight')
+        self.assertNotIn('search_vector', response.data)
+
+        response = self.client.get(reverse('habit:habit', kwargs={'pk': self.new_habit.id}),
+                                   {'fields': 'search_vector'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_read_habit_not_modified(self):
+        """ Testing conditional GETs of a habit """
+        url = reverse('habit:habit', kwargs={'pk': self.new_habit.id})
+        # The validators come from the habit loaded for the response
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        etag = response['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Deleting the related habit changes this one
+        self.old_habit.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_habit_not_modified(self):
+        """ Testing conditional GETs of the user's habit list """
+        self.user.refresh_from_db()
+        url = reverse('habit:habit-list-create')
+        response = self.client.get(url)
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Another page has its own ETag
+        response = self.client.get(url, {'page': 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Someone else's habit doesn't change the list
+        Habit.objects.create(user=self.other_user, action='reading', time='21:00', place='sofa')
+        self.user.refresh_from_db()
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.post(url, data={'action': 'stretching', 'time': '08:00', 'place': 'gym'})
+        self.user.refresh_from_db()
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
 
     def test_update_habit(self):
         """ Habit editing test """
@@ -201,3 +453,729 @@ class HabitTestCase(APITestCase):
         self.client.force_authenticate(user=self.other_user)
         response = self.client.delete(reverse('habit:habit-delete', kwargs={'pk': self.new_habit.pk}))
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_sync_habits(self):
+        """ Testing delta syncs of the user's habits """
+        url = reverse('habit:habit-sync')
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['full'])
+        self.assertEqual(len(response.data['habits']), 2)
+
+        # Rows saved within the token's overlap come again, so the clock is moved past it
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(minutes=1)):
+            stretching = Habit.objects.create(user=self.user, action='stretching', time='08:00', place='gym')
+            self.client.delete(reverse('habit:habit-delete', kwargs={'pk': self.old_habit.pk}))
+            Habit.objects.create(user=self.other_user, action='reading', time='21:00', place='sofa')
+
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(minutes=2)):
+            response = self.client.get(url, {'since': response.data['token']})
+
+        self.assertFalse(response.data['full'])
+        # The habit linked to the deleted one changed too
+        self.assertEqual([habit['id'] for habit in response.data['habits']], [self.new_habit.pk, stretching.pk])
+        self.assertNotIn('related_habit', response.data['habits'][0])
+        self.assertEqual(response.data['deleted'], [self.old_habit.pk])
+
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(minutes=3)):
+            response = self.client.get(url, {'since': response.data['token']})
+        self.assertEqual(response.data['habits'], [])
+        self.assertEqual(response.data['deleted'], [])
+
+    def test_sync_habits_invalid_token(self):
+        """ Testing that sync tokens of other users are rejected """
+        token = self.client.get(reverse('habit:habit-sync')).data['token']
+        self.client.force_authenticate(user=self.other_user)
+
+        response = self.client.get(reverse('habit:habit-sync'), {'since': token})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_habits(self):
+        """ Testing bulk creation, update and deletion of habits """
+        operations = [{'op': 'create', 'data': {'action': f'habit {number}', 'time': '23:00', 'place': 'home',
+                                                'related_habit': self.old_habit.pk}}
+                      for number in range(50)]
+        operations += [
+            {'op': 'update', 'id': self.old_habit.pk, 'data': {'time': '22:00', 'place': 'sink'}},
+            # The deleted habit's action is free for the new one
+            {'op': 'create', 'data': {'action': 'going to bed before midnight', 'time': '23:00', 'place': 'bed',
+                                      'reward': 'tea'}},
+            {'op': 'delete', 'id': self.new_habit.pk},
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('habit:habit-bulk'), operations, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLess(len(queries), 20)
+        self.assertEqual([result['status'] for result in response.data[-4:]],
+                         ['created', 'updated', 'created', 'deleted'])
+        self.assertEqual([result['id'] for result in response.data[-3:-1]],
+                         [self.old_habit.pk, Habit.objects.get(place='bed').pk])
+        self.assertEqual(response.data[-1]['id'], self.new_habit.pk)
+        self.assertEqual(Habit.objects.filter(user=self.user, related_habit=self.old_habit).count(), 50)
+        self.assertFalse(Habit.objects.filter(pk=self.new_habit.pk).exists())
+        self.old_habit.refresh_from_db()
+        self.assertEqual(self.old_habit.place, 'sink')
+        self.assertEqual(timezone.localtime(self.old_habit.next_due_at).time(), time(22, 0))
+        habit = Habit.objects.get(pk=response.data[0]['id'])
+        self.assertIsNotNone(habit.next_due_at)
+
+    def test_bulk_delete_habits(self):
+        """ Testing that bulk deletion writes tombstones and stamps dependents in a constant number of queries """
+        habits = Habit.objects.bulk_create([Habit(user=self.user, action=f'habit {number}', time='23:00',
+                                                  place='home') for number in range(20)])
+        dependent = Habit.objects.create(user=self.other_user, action='reading', time='21:00', place='sofa',
+                                         related_habit=habits[0])
+        stamped_at = timezone.now() - timedelta(days=1)
+        Habit.objects.filter(pk=dependent.pk).update(updated_at=stamped_at)
+        get_user_model().objects.filter(pk__in=[self.user.pk, self.other_user.pk]).update(
+            habits_modified_at=stamped_at)
+        operations = [{'op': 'delete', 'id': habit.pk} for habit in habits]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('habit:habit-bulk'), operations, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLess(len(queries), 20)
+        self.assertEqual([(result['id'], result['status']) for result in response.data],
+                         [(habit.pk, 'deleted') for habit in habits])
+        self.assertFalse(Habit.objects.filter(pk__in=[habit.pk for habit in habits]).exists())
+        self.assertCountEqual(HabitTombstone.objects.filter(user=self.user).values_list('habit_id', flat=True),
+                              [habit.pk for habit in habits])
+        dependent.refresh_from_db()
+        self.assertIsNone(dependent.related_habit)
+        self.assertGreater(dependent.updated_at, stamped_at)
+        self.user.refresh_from_db()
+        self.other_user.refresh_from_db()
+        self.assertGreater(self.user.habits_modified_at, stamped_at)
+        self.assertGreater(self.other_user.habits_modified_at, stamped_at)
+
+    def test_bulk_habits_same_id(self):
+        """ Testing that a habit can be the target of one operation of a bulk request only """
+        for operations in ([{'op': 'update', 'id': self.new_habit.pk, 'data': {'place': 'sofa'}},
+                            {'op': 'delete', 'id': self.new_habit.pk}],
+                           [{'op': 'delete', 'id': self.new_habit.pk},
+                            {'op': 'delete', 'id': self.new_habit.pk}],
+                           [{'op': 'update', 'id': self.new_habit.pk, 'data': {'place': 'sofa'}},
+                            {'op': 'update', 'id': self.new_habit.pk, 'data': {'place': 'bed'}}]):
+            response = self.client.post(reverse('habit:habit-bulk'), operations, format='json')
+
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data[0]['status'], 'valid')
+            self.assertIn('id', response.data[1]['errors'])
+            self.assertTrue(Habit.objects.filter(pk=self.new_habit.pk, place=self.new_habit.place).exists())
+            self.assertFalse(HabitTombstone.objects.exists())
+
+    def test_bulk_habits_rejected(self):
+        """ Testing that a bulk request with an invalid operation changes nothing """
+        operations = [
+            {'op': 'create', 'data': {'action': 'stretching', 'time': '08:00', 'place': 'gym'}},
+            {'op': 'create', 'data': {'action': 'stretching', 'time': '09:00', 'place': 'gym'}},
+            {'op': 'create', 'data': {'action': 'reading', 'time': '21:00', 'place': 'sofa',
+                                      'related_habit': self.new_habit.pk}},
+            {'op': 'update', 'id': self.old_habit.pk, 'data': {'reward': 'tea'}},
+            {'op': 'delete', 'id': Habit.objects.create(user=self.other_user, action='walk', time='10:00',
+                                                        place='park').pk},
+            {'op': 'create', 'data': {'action': 'singing', 'time': '08:00', 'place': 'shower'}},
+            {'op': 'create', 'data': {'action': 'dancing', 'time': '20:00', 'place': 'hall', 'related_habit': True}},
+        ]
+
+        response = self.client.post(reverse('habit:habit-bulk'), operations, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {'op': 'create', 'status': 'valid'})
+        self.assertIn('action', response.data[1]['errors'])
+        # Not learned yet, and learned habits take no reward
+        self.assertIn('non_field_errors', response.data[2]['errors'])
+        self.assertIn('non_field_errors', response.data[3]['errors'])
+        self.assertIn('id', response.data[4]['errors'])
+        self.assertEqual(response.data[5], {'op': 'create', 'status': 'valid'})
+        self.assertEqual(response.data[6]['errors']['related_habit'][0].code, 'incorrect_type')
+        self.assertFalse(Habit.objects.filter(action__in=['stretching', 'singing']).exists())
+
+    def test_export_habits(self):
+        """ Testing the NDJSON and CSV exports of the user's habits """
+        Habit.objects.create(user=self.other_user, action='reading', time='21:00', place='sofa', is_public=True)
+
+        response = self.client.get(reverse('habit:habit-export'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         HabitSerializer(Habit.objects.filter(user=self.user).order_by('pk'), many=True).data)
+
+        response = self.client.get(reverse('habit:habit-export'), {'as': 'csv', 'fields': 'id,action,reward'})
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(b''.join(response.streaming_content).decode().splitlines(),
+                         ['id,action,reward', f'{self.old_habit.pk},brushing my teeth,',
+                          f'{self.new_habit.pk},going to bed before midnight,'])
+
+    def test_export_public_habits(self):
+        """ Testing that only staff can export the public habits """
+        response = self.client.get(reverse('habit:habit-export'), {'scope': 'public'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('habit:habit-export'), {'scope': 'public', 'fields': 'action'})
+
+        self.assertEqual(b''.join(response.streaming_content).decode().splitlines(),
+                         ['{"action": "going to bed before midnight"}'])
+
+    def test_import_habits(self):
+        """ Testing that a CSV import creates the valid rows and reports the others """
+        upload = SimpleUploadedFile('habits.csv', '\n'.join([
+            'action,time,place,frequency,related_habit,reward',
+            'stretching,08:00,gym,1,,',
+            'walking,09:00,park,9,,',
+            'brushing my teeth,10:00,bathroom,,,',
+            f'reading,23:00,sofa,,{self.old_habit.pk},',
+            f'singing,23:30,shower,,{self.new_habit.pk},',
+            'stretching,10:00,home,,,',
+            'drinking tea,16:00,kitchen,,,cake',
+        ]).encode())
+
+        response = self.client.post(reverse('habit:habit-import'), {'file': upload})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data['rows'], response.data['created'], response.data['failed']), (7, 3, 4))
+        # Frequency limit, taken action, related habit not learned, duplicate in the file
+        self.assertEqual([(error['line'], list(error['errors'])) for error in response.data['errors']],
+                         [(3, ['frequency']), (4, ['action']), (6, ['non_field_errors']), (7, ['action'])])
+        self.assertEqual(Habit.objects.get(action='reading').related_habit, self.old_habit)
+        self.assertEqual(Habit.objects.get(action='drinking tea').reward, 'cake')
+        self.assertIsNotNone(Habit.objects.get(action='stretching').next_due_at)
+
+    def test_import_habits_unreadable_rows(self):
+        """ Testing that undecodable and unparsable CSV rows are reported without aborting the file """
+        upload = SimpleUploadedFile('habits.csv', b'\n'.join([
+            b'action,time,place',
+            b'stretching,08:00,gym',
+            b'walking \xff,09:00,park',
+            b'reading,21:00,' + b'x' * 200000,
+            b'drinking tea,16:00,kitchen',
+        ]))
+
+        response = self.client.post(reverse('habit:habit-import'), {'file': upload})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data['rows'], response.data['created'], response.data['failed']), (4, 2, 2))
+        self.assertEqual([(error['line'], error['errors']['non_field_errors'][0][:12])
+                          for error in response.data['errors']],
+                         [(3, 'Invalid UTF-'), (4, 'Invalid CSV:')])
+
+    def test_import_habits_command(self):
+        """ Testing the NDJSON import command, one batch at a time """
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False) as file:
+            for number in range(5):
+                file.write(json.dumps({'action': f'habit {number}', 'time': '08:00', 'place': 'home'}) + '\n')
+            file.write('not json\n')
+        self.addCleanup(os.remove, file.name)
+        out, err = StringIO(), StringIO()
+
+        call_command('import_habits', file.name, user='user@example.com', batch_size=2, stdout=out, stderr=err)
+
+        self.assertEqual(Habit.objects.filter(user=self.user, action__startswith='habit ').count(), 5)
+        self.assertIn('5 habits imported, 1 rows failed', out.getvalue())
+        self.assertIn('line 6', err.getvalue())
+
+
+class ReminderTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.now = timezone.make_aware(datetime(2030, 1, 1, 8, 0))
+        self.redis = use_fake_redis(self)
+
+        self.user = get_user_model().objects.create(email='user@example.com', telegram='111')
+        self.other_user = get_user_model().objects.create(email='other@example.com', telegram='222')
+        self.silent_user = get_user_model().objects.create(email='silent@example.com')
+
+        self.habit = Habit.objects.create(user=self.user, action='drink water', time='08:00', place='kitchen')
+        self.other_habit = Habit.objects.create(user=self.other_user, action='stretch', time='08:00', place='home')
+        self.later_habit = Habit.objects.create(user=self.user, action='walk', time='09:00', place='park')
+        Habit.objects.create(user=self.user, action='read', time='08:00', place='home', is_learned=True)
+        Habit.objects.create(user=self.silent_user, action='meditate', time='08:00', place='home')
+
+        Habit.objects.filter(time='08:00').update(next_due_at=self.now)
+        Habit.objects.filter(time='09:00').update(next_due_at=self.now + timedelta(hours=1))
+
+    def test_next_due_at_on_create(self):
+        """ Testing that a new habit is scheduled at its next occurrence """
+        self.assertIsNotNone(self.habit.next_due_at)
+        self.assertGreater(self.habit.next_due_at, timezone.now())
+        self.assertEqual(timezone.localtime(self.habit.next_due_at).time(), time(8, 0))
+
+    def test_next_occurrence_honours_frequency(self):
+        """ Testing that reminders are spaced `frequency` days apart from the start date """
+        start = date(2030, 1, 1)
+
+        self.assertEqual(next_occurrence(start, time(8, 0), 3, after=self.now),
+                         self.now + timedelta(days=3))
+        self.assertEqual(next_occurrence(start, time(8, 0), 3, after=self.now + timedelta(days=1)),
+                         self.now + timedelta(days=3))
+        self.assertEqual(next_occurrence(start, time(9, 0), 3, after=self.now),
+                         self.now + timedelta(hours=1))
+
+    def test_next_occurrence_across_dst(self):
+        """ Testing that reminders keep their local time when daylight saving time starts """
+        new_york = zoneinfo.ZoneInfo('America/New_York')
+        before_dst = timezone.make_aware(datetime(2030, 3, 9, 9, 0), new_york)
+
+        first = next_occurrence(date(2030, 1, 1), time(8, 0), 1, after=before_dst, tz=new_york)
+        second = next_occurrence(date(2030, 1, 1), time(8, 0), 1, after=first, tz=new_york)
+
+        self.assertEqual(first, datetime(2030, 3, 10, 12, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual(second, datetime(2030, 3, 11, 12, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual(timezone.localtime(second, new_york).time(), time(8, 0))
+
+    def test_next_due_at_in_user_timezone(self):
+        """ Testing that habits fire at their local time in the user's time zone """
+        self.user.timezone = 'Asia/Tokyo'
+        self.user.save()
+
+        reschedule_user_habits(self.user)
+
+        self.habit.refresh_from_db()
+        self.assertEqual(timezone.localtime(self.habit.next_due_at, zoneinfo.ZoneInfo('Asia/Tokyo')).time(),
+                         time(8, 0))
+
+    def test_claim_due_reminders(self):
+        """ Testing that due habits of all users are claimed once in the delivery ledger """
+        claim = uuid.uuid4()
+        ranges = list(claim_due_reminders(claim, self.now))
+
+        self.assertEqual(len(ranges), 1)
+        self.assertEqual(list(get_claimed_reminders(claim, ranges[0])), [
+            (ranges[0][0], self.habit.pk, 'drink water', '111', None, self.now),
+            (ranges[0][1], self.other_habit.pk, 'stretch', '222', None, self.now),
+        ])
+        self.assertFalse(get_due_habits(self.now).exists())
+
+        # An overlapping run that still sees the old schedule claims nothing
+        Habit.objects.filter(time='08:00').update(next_due_at=self.now)
+        self.assertEqual(list(claim_due_reminders(uuid.uuid4(), self.now)), [])
+
+    def test_schedule_next_reminders(self):
+        """ Testing that sent reminders are moved to the next occurrence """
+        Habit.objects.filter(pk=self.habit.pk).update(frequency=2, start_from=self.now.date())
+
+        schedule_next_reminders([self.habit.pk], self.now)
+
+        self.habit.refresh_from_db()
+        self.assertEqual(self.habit.next_due_at, self.now + timedelta(days=2))
+        self.assertNotIn(self.habit, get_due_habits(self.now))
+
+    def test_update_reschedules_reminder(self):
+        """ Testing that changing the habit's time through the API reschedules its reminder """
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+
+        response = client.patch(reverse('habit:habit-update', kwargs={'pk': self.later_habit.pk}),
+                                data={'time': '10:30'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.later_habit.refresh_from_db()
+        self.assertGreater(self.later_habit.next_due_at, timezone.now())
+        self.assertEqual(timezone.localtime(self.later_habit.next_due_at).time(), time(10, 30))
+
+    def test_claim_in_chunks(self):
+        """ Testing that the due set is claimed in fixed-size ledger id ranges without splitting a chat """
+        third_user = get_user_model().objects.create(email='third@example.com', telegram='333')
+        for user, action in ((self.other_user, 'jump'), (third_user, 'run')):
+            habit = Habit.objects.create(user=user, action=action, time='08:00', place='yard')
+            Habit.objects.filter(pk=habit.pk).update(next_due_at=self.now)
+        claim = uuid.uuid4()
+
+        ranges = list(claim_due_reminders(claim, self.now, size=2))
+
+        self.assertEqual([[action for pk, habit_id, action, *rest in get_claimed_reminders(claim, id_range)]
+                          for id_range in ranges],
+                         [['drink water', 'stretch', 'jump'], ['run']])
+
+    @override_settings(REMINDER_CHUNK_SIZE=1)
+    def test_send_reminder_fans_out(self):
+        """ Testing that delivery subtasks send every due reminder and the tick records the totals """
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+
+        with TelegramStub() as stub, \
+                mock.patch('habit.tasks.timezone.now', return_value=self.now), \
+                mock.patch('habit.tasks.get_telegram_client', return_value=TelegramClient(stub.url, 'token')):
+            send_reminder()
+            # A second dispatcher in the same minute doesn't get the lease
+            send_reminder()
+
+        self.assertEqual(sorted(message['chat_id'] for message in stub.messages), ['111', '222'])
+        tick = ReminderTick.objects.get()
+        self.assertEqual((tick.due, tick.sent, tick.failed), (2, 2, 0))
+        self.assertIsNotNone(tick.finished_at)
+        self.assertFalse(get_due_habits(self.now).exists())
+        self.assertEqual([delivery.lag for delivery in ReminderDelivery.objects.all()], [timedelta(0)] * 2)
+
+    @override_settings(REMINDER_CHUNK_SIZE=1)
+    def test_unhandled_reminders_redispatched(self):
+        """ Testing that ranges claimed by a dispatcher that died are delivered by the redispatch sweep """
+        with mock.patch('habit.tasks.timezone.now', return_value=self.now), \
+                mock.patch('habit.tasks.deliver_reminders.delay', side_effect=[None, ConnectionError]) as delay:
+            with self.assertRaises(ConnectionError):
+                send_reminder()
+
+        # Every range is handed over as soon as it is claimed
+        self.assertEqual(delay.call_count, 2)
+        self.assertEqual(ReminderDelivery.objects.count(), 2)
+        ReminderDelivery.objects.update(claimed_at=self.now - timedelta(minutes=15))
+        ReminderDelivery.objects.filter(habit=self.habit).update(failed_at=self.now)
+
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        with TelegramStub() as stub, \
+                mock.patch('habit.tasks.timezone.now', return_value=self.now), \
+                mock.patch('habit.tasks.get_telegram_client', return_value=TelegramClient(stub.url, 'token')):
+            redispatch_reminders()
+            redispatch_reminders()
+
+        # Reminders handed to retries are left to them
+        self.assertEqual([message['chat_id'] for message in stub.messages], ['222'])
+        self.assertTrue(ReminderDelivery.objects.get(habit=self.other_habit).sent_at)
+
+    def test_reminders_sent_outside_transaction(self):
+        """ Testing that reminders are leased in a transaction of their own and sent after it is committed """
+        claim = uuid.uuid4()
+        (id_range,) = claim_due_reminders(claim, self.now)
+        savepoints = len(connection.savepoint_ids)
+
+        def send_many(messages):
+            self.assertEqual(len(connection.savepoint_ids), savepoints)
+            self.assertEqual(set(ReminderDelivery.objects.values_list('sending_until', flat=True)),
+                             {self.now + timedelta(minutes=15)})
+            # Copies of the range and the redispatch sweep leave leased reminders alone
+            self.assertEqual(list(get_claimed_reminders(claim, id_range, self.now)), [])
+            self.assertEqual(list(get_unhandled_reminder_ranges(self.now + timedelta(minutes=10),
+                                                                current_time=self.now)), [])
+            return [SendResult(chat_id, ok=True) for chat_id, text in messages]
+
+        client = mock.Mock(send_many=mock.Mock(side_effect=send_many))
+        with mock.patch('habit.tasks.timezone.now', return_value=self.now), \
+                mock.patch('habit.tasks.get_telegram_client', return_value=client):
+            totals = deliver_reminders(str(claim), *id_range)
+
+        self.assertEqual(totals['sent'], 2)
+        self.assertEqual(ReminderDelivery.objects.filter(sent_at=self.now).count(), 2)
+        # A lease outlived by a dead worker is taken again
+        ReminderDelivery.objects.update(sent_at=None)
+        self.assertEqual(len(get_claimed_reminders(claim, id_range, self.now + timedelta(minutes=16))), 2)
+
+    def test_metrics_endpoint(self):
+        """ Testing that the reminder pipeline reports its metrics in the Prometheus format to the scraper only """
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+
+        with TelegramStub() as stub, \
+                mock.patch('habit.tasks.get_telegram_client', return_value=TelegramClient(stub.url, 'token')):
+            stub.fail_next(503)
+            with mock.patch('habit.tasks.retry_reminder.apply_async'), \
+                    mock.patch('habit.tasks.timezone.now', return_value=self.now + timedelta(seconds=20)):
+                send_reminder()
+
+        with override_settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer None').status_code,
+                             status.HTTP_401_UNAUTHORIZED)
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_401_UNAUTHORIZED)
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code,
+                             status.HTTP_401_UNAUTHORIZED)
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = response.content.decode()
+        for line in ('reminders_due_total 2', 'reminders_sent_total 1', 'reminders_failed_total 1',
+                     'reminders_retried_total 1', 'reminders_slot_due 2', 'telegram_messages_total 2',
+                     'telegram_send_seconds_count 2', 'reminders_lag_seconds_bucket{le="30"} 1',
+                     'reminders_lag_seconds_bucket{le="15"} 0', 'reminders_backlog_seconds 20.0'):
+            self.assertIn(line, content)
+
+    def test_send_reminder_catches_up(self):
+        """ Testing that missed reminders are sent late and stale ones dropped """
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        Habit.objects.filter(pk=self.habit.pk).update(next_due_at=self.now - timedelta(minutes=30))
+        Habit.objects.filter(pk=self.other_habit.pk).update(next_due_at=self.now - timedelta(hours=2))
+
+        with TelegramStub() as stub, \
+                mock.patch('habit.tasks.timezone.now', return_value=self.now), \
+                mock.patch('habit.tasks.get_telegram_client', return_value=TelegramClient(stub.url, 'token')):
+            send_reminder()
+
+        self.assertEqual([message['chat_id'] for message in stub.messages], ['111'])
+        tick = ReminderTick.objects.get()
+        self.assertEqual((tick.sent, tick.stale, tick.backlog), (1, 1, timedelta(hours=2)))
+        self.assertFalse(get_due_habits(self.now).filter(user__telegram__isnull=False).exists())
+
+    def test_reminders_coalesced_per_chat(self):
+        """ Testing that all of a user's habits due in the same minute share one message """
+        for action in ('make the bed', 'open the window'):
+            habit = Habit.objects.create(user=self.user, action=action, time='08:00', place='bedroom')
+            Habit.objects.filter(pk=habit.pk).update(next_due_at=self.now)
+        claim = uuid.uuid4()
+
+        with TelegramStub() as stub, \
+                mock.patch('habit.tasks.get_telegram_client', return_value=TelegramClient(stub.url, 'token')):
+            totals = [deliver_reminders(str(claim), first_id, last_id)
+                      for first_id, last_id in claim_due_reminders(claim, self.now)]
+
+        self.assertEqual(stub.hits, 2)
+        self.assertEqual(totals, [{'due': 4, 'sent': 4, 'failed': 0, 'retried': 0}])
+        texts = {message['chat_id']: message['text'] for message in stub.messages}
+        self.assertEqual(texts['111'], "It's time to do:\n- drink water\n- make the bed\n- open the window")
+        self.assertEqual(texts['222'], "It's time to do stretch.")
+
+    def test_daily_digest(self):
+        """ Testing that digest users get reminders of all their habits at the digest time """
+        self.user.digest_time = time(7, 30)
+        self.user.save()
+        reschedule_user_habits(self.user)
+
+        self.habit.refresh_from_db()
+        self.later_habit.refresh_from_db()
+        self.assertEqual(self.habit.next_due_at, self.later_habit.next_due_at)
+        self.assertEqual(timezone.localtime(self.habit.next_due_at).time(), time(7, 30))
+        self.assertEqual(render_reminder(['drink water', 'walk'], digest=True),
+                         'Your habits for today:\n- drink water\n- walk')
+
+    def test_failed_reminders_are_retried(self):
+        """ Testing that throttled and failed sends are re-enqueued with backoff """
+        with TelegramStub() as stub, \
+                mock.patch('habit.tasks.get_telegram_client', return_value=TelegramClient(stub.url, 'token')), \
+                mock.patch('habit.tasks.retry_reminder.apply_async') as apply_async:
+            stub.fail_next(429, retry_after=7)
+            stub.fail_next(503)
+            claim = uuid.uuid4()
+            [(first_id, last_id)] = claim_due_reminders(claim, self.now)
+            totals = deliver_reminders(str(claim), first_id, last_id)
+
+        self.assertEqual(totals, {'due': 2, 'sent': 0, 'failed': 2, 'retried': 2})
+        self.assertEqual(sorted(call.kwargs['countdown'] for call in apply_async.call_args_list), [7, 30])
+        self.assertFalse(DeadLetter.objects.exists())
+        self.assertFalse(ReminderDelivery.objects.filter(sent_at__isnull=False).exists())
+
+    @override_settings(REMINDER_MAX_ATTEMPTS=3)
+    def test_reminder_dead_letter(self):
+        """ Testing that a reminder lands in the dead-letter table after the last attempt """
+        with TelegramStub() as stub, \
+                mock.patch('habit.tasks.get_telegram_client', return_value=TelegramClient(stub.url, 'token')), \
+                mock.patch('habit.tasks.retry_reminder.apply_async') as apply_async:
+            stub.fail_next(502)
+            retry_reminder([self.habit.pk, self.later_habit.pk], '111', 'hello', 3, [7, 8])
+
+        apply_async.assert_not_called()
+        dead_letter = DeadLetter.objects.get()
+        self.assertEqual((dead_letter.habit, dead_letter.attempts, dead_letter.status), (self.habit, 3, 502))
+        self.assertEqual((dead_letter.habit_ids, dead_letter.delivery_ids),
+                         ([self.habit.pk, self.later_habit.pk], [7, 8]))
+
+    def test_replay_dead_letters(self):
+        """ Testing that dead letters are re-enqueued in bulk """
+        delivery = ReminderDelivery.objects.create(habit=self.habit, scheduled_at=self.now, claim=uuid.uuid4(),
+                                                   failed_at=self.now)
+        DeadLetter.objects.create(habit=self.habit, habit_ids=[self.habit.pk, self.later_habit.pk],
+                                  delivery_ids=[delivery.pk], chat_id='111', text='hello', attempts=5)
+
+        with TelegramStub() as stub, \
+                mock.patch('habit.tasks.get_telegram_client', return_value=TelegramClient(stub.url, 'token')), \
+                mock.patch('habit.tasks.retry_reminder.delay', side_effect=retry_reminder) as delay:
+            call_command('replay_dead_letters', stdout=StringIO())
+
+        delay.assert_called_once_with([self.habit.pk, self.later_habit.pk], '111', 'hello', 1, [delivery.pk])
+        self.assertFalse(DeadLetter.objects.exists())
+        delivery.refresh_from_db()
+        self.assertIsNotNone(delivery.sent_at)
+
+
+class ReminderSchedulerTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.now = timezone.make_aware(datetime(2030, 1, 1, 8, 0))
+        self.user = get_user_model().objects.create(email='user@example.com', telegram='111')
+
+        self.habit = Habit.objects.create(user=self.user, action='drink water', time='08:00', place='kitchen')
+        self.later_habit = Habit.objects.create(user=self.user, action='walk', time='09:00', place='park')
+        self.learned_habit = Habit.objects.create(user=self.user, action='read', time='08:00', place='home',
+                                                  is_learned=True)
+        Habit.objects.filter(pk=self.habit.pk).update(next_due_at=self.now)
+        Habit.objects.filter(pk=self.later_habit.pk).update(next_due_at=self.now + timedelta(hours=1))
+        self.habit.refresh_from_db()
+        self.later_habit.refresh_from_db()
+
+    def test_signals_update_scheduler(self):
+        """ Testing that saving and deleting a habit updates the scheduler """
+        with mock.patch('habit.signals.get_scheduler') as get_scheduler:
+            habit = Habit.objects.create(user=self.user, action='stretch', time='07:00', place='home')
+            habit_id = habit.pk
+            habit.delete()
+
+        get_scheduler().schedule.assert_called_once_with([habit])
+        get_scheduler().unschedule.assert_called_once_with([habit_id])
+
+    def test_database_scheduler_cuts_chatless_habits(self):
+        """ Testing that habits of users without a chat never keep a batch open """
+        for number in range(3):
+            user = get_user_model().objects.create(email=f'silent{number}@example.com')
+            for action in ('stretch', 'meditate'):
+                Habit.objects.create(user=user, action=f'{action} {number}', time='08:00', place='home')
+        due_habits = get_due_habits(self.now).filter(user__telegram__isnull=True)
+        due_habits.update(next_due_at=self.now)
+
+        batches = list(DatabaseScheduler().get_due_batches(due_habits, self.now, 2))
+
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 2])
+
+    def test_redis_scheduler_schedule(self):
+        """ Testing that active habits are added to the sorted set and learned ones removed """
+        client = mock.MagicMock()
+
+        RedisScheduler(client).schedule([self.habit, self.learned_habit])
+
+        pipeline = client.pipeline()
+        pipeline.zadd.assert_called_once_with(RedisScheduler.key, {self.habit.pk: self.now.timestamp()})
+        pipeline.zrem.assert_called_once_with(RedisScheduler.key, self.learned_habit.pk)
+
+    def test_redis_scheduler_due_batches(self):
+        """ Testing that popped habits are checked against the database and stale members put back """
+        client = mock.MagicMock()
+        client.register_script.return_value = mock.Mock(side_effect=[
+            [str(self.habit.pk).encode(), str(self.later_habit.pk).encode()], [],
+        ])
+
+        batches = list(RedisScheduler(client).get_due_batches(get_due_habits(self.now), self.now, 2))
+
+        self.assertEqual(batches, [[(self.habit.pk, self.now, '111')]])
+        client.pipeline().zadd.assert_called_once_with(
+            RedisScheduler.key, {self.later_habit.pk: self.later_habit.next_due_at.timestamp()})
+
+    def test_redis_scheduler_keeps_chats_together(self):
+        """ Testing that a batch takes along the due habits of its users that weren't popped yet """
+        habit = Habit.objects.create(user=self.user, action='stretch', time='08:00', place='home')
+        Habit.objects.filter(pk=habit.pk).update(next_due_at=self.now)
+        client = mock.MagicMock()
+        client.register_script.return_value = mock.Mock(side_effect=[[str(self.habit.pk).encode()], []])
+
+        batches = list(RedisScheduler(client).get_due_batches(get_due_habits(self.now), self.now, 1))
+
+        self.assertEqual(batches, [[(self.habit.pk, self.now, '111'), (habit.pk, self.now, '111')]])
+        client.zrem.assert_called_once_with(RedisScheduler.key, habit.pk)
+
+
+class QueryPlanTestCase(TestCase):
+    """ Testing that the hot habit queries keep using their indexes on a large table """
+    users = 20
+    habits_per_user = 1000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.now = timezone.now()
+        users = get_user_model().objects.bulk_create(
+            get_user_model()(email=f'user{number}@example.com') for number in range(cls.users)
+        )
+        cls.user = users[0]
+        Habit.objects.bulk_create((
+            Habit(user=users[number % cls.users], action=f'habit {number}', time='10:00', place='home',
+                  description='drink a glass of water' if number % 100 == 0 else 'read a book',
+                  is_public=number % 20 == 0, is_learned=number % 2 == 0,
+                  next_due_at=cls.now + timedelta(minutes=number % 10000 - 100))
+            for number in range(cls.users * cls.habits_per_user)
+        ), batch_size=2000)
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE habit_habit SET updated_at = now() - (id % 30) * interval '1 day'")
+            cursor.execute('ANALYZE habit_habit')
+
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        self.assertNotIn('Seq Scan on habit_habit', plan, plan)
+
+    def test_public_feed_plan(self):
+        """ Testing the public feed pages """
+        public_habits = Habit.objects.filter(is_public=True).order_by('pk')
+        self.assertUsesIndex(public_habits[:20])
+        self.assertUsesIndex(public_habits.filter(pk__gt=10000)[:20])
+
+    def test_user_habits_plan(self):
+        """ Testing the pages of a user's habits and the profile's first habits """
+        habits = Habit.objects.filter(user=self.user).order_by('pk')
+        self.assertUsesIndex(habits[:20])
+        self.assertUsesIndex(habits.filter(pk__gt=10000)[:20])
+        self.assertUsesIndex(Habit.objects.filter(is_public=True, user_id__in=[self.user.pk]).order_by('pk'))
+
+    def test_due_habits_plan(self):
+        """ Testing the due reminders scan """
+        self.assertUsesIndex(get_due_habits(self.now))
+
+    def test_sync_plan(self):
+        """ Testing the delta sync of a user's habits """
+        self.assertUsesIndex(Habit.objects.filter(user=self.user, updated_at__gt=self.now - timedelta(days=1)))
+
+    def test_search_plan(self):
+        """ Testing the public habit search and autocomplete """
+        self.assertUsesIndex(search_public_habits('water').order_by('-rank', 'pk')[:20])
+        self.assertUsesIndex(Habit.objects.filter(is_public=True).annotate(action_lower=Lower('action')).filter(
+            action_lower__startswith='habit 10'
+        ).order_by('action_lower')[:10])
+
+
+class TelegramClientTestCase(SimpleTestCase):
+
+    def test_send_many_concurrently(self):
+        """ Testing that messages are sent in parallel over the pooled session """
+        messages = [(str(chat_id), 'hello') for chat_id in range(10)]
+
+        with TelegramStub(latency=0.2) as stub:
+            client = TelegramClient(stub.url, 'token', max_connections=10)
+            started = timezone.now()
+            results = client.send_many(messages)
+            elapsed = timezone.now() - started
+
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual([result.chat_id for result in results], [chat_id for chat_id, text in messages])
+        self.assertEqual(stub.hits, 10)
+        self.assertLess(elapsed, timedelta(seconds=1))
+
+    def test_send_message_failure(self):
+        """ Testing that API errors are reported with Telegram's retry_after """
+        with TelegramStub() as stub:
+            stub.fail_next(429, retry_after=7)
+            result = TelegramClient(stub.url, 'token').send_message('111', 'hello')
+
+        self.assertFalse(result.ok)
+        self.assertEqual((result.status, result.retry_after), (429, 7))
+
+    def test_send_message_network_error(self):
+        """ Testing that network errors don't raise """
+        result = TelegramClient('http://127.0.0.1:9/bot', 'token', timeout=1).send_message('111', 'hello')
+
+        self.assertFalse(result.ok)
+        self.assertIsNone(result.status)
+        self.assertTrue(result.error)
+
+    @override_settings(TELEGRAM_RATE_LIMIT=30, REDIS_URL='redis://cache:6379/1',
+                       CELERY_BROKER_URL='redis://broker:6379/0')
+    def test_rate_limit_in_shared_redis(self):
+        """ Testing that the rate limiter keeps its bucket in the shared Redis rather than in the broker """
+        with mock.patch('habit.connections.get_redis_client') as get_redis_client:
+            get_telegram_client()
+
+        get_redis_client.assert_called_once_with('redis://cache:6379/1')
+
+    def test_token_bucket_waits_for_token(self):
+        """ Testing that the rate limiter sleeps for as long as the shared bucket says """
+        redis_client = mock.Mock()
+        redis_client.register_script.return_value = mock.Mock(side_effect=[40, 0])
+        bucket = RedisTokenBucket(redis_client, 'bucket', rate=30)
+
+        with mock.patch('habit.telegram.time.sleep') as sleep:
+            bucket.acquire()
+
+        sleep.assert_called_once_with(0.04)
@@ -1,13 +1,20 @@
 from django.urls import path
 
 from habit.apps import HabitConfig
-from habit.views import HabitApiList, HabitUpdateApiView, HabitDestroyApiView, HabitDetailApiView, PublicHabitApiList
+from habit.views import (HabitApiList, HabitBulkApiView, HabitUpdateApiView, HabitDestroyApiView, HabitDetailApiView,
+                         HabitExportApiView, HabitImportApiView, HabitSyncApiView, PublicHabitApiList,
+                         PublicHabitAutocompleteApiView)
 
 app_name = HabitConfig.name
 
 urlpatterns = [
     path('habits/', HabitApiList.as_view(), name='habit-list-create'),
     path('habits/public/', PublicHabitApiList.as_view(), name='public-habit-list'),
+    path('habits/public/autocomplete/', PublicHabitAutocompleteApiView.as_view(), name='public-habit-autocomplete'),
+    path('habits/sync/', HabitSyncApiView.as_view(), name='habit-sync'),
+    path('habits/bulk/', HabitBulkApiView.as_view(), name='habit-bulk'),
+    path('habits/export/', HabitExportApiView.as_view(), name='habit-export'),
+    path('habits/import/', HabitImportApiView.as_view(), name='habit-import'),
     path('habits/<int:pk>/', HabitDetailApiView.as_view(), name='habit'),
     path('habits/<int:pk>/edit/', HabitUpdateApiView.as_view(), name='habit-update'),
     path('habits/<int:pk>/delete/', HabitDestroyApiView.as_view(), name='habit-delete')
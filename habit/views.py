@@ -1,14 +1,125 @@
-from rest_framework import generics
-from rest_framework.exceptions import ValidationError
+import csv
+import hashlib
+import json
+import os
+from datetime import timedelta
+from functools import cached_property
+
+from django.conf import settings
+from django.core import signing
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
+from django.utils import timezone
+from django.utils.http import http_date, quote_etag
+from rest_framework import generics, status
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
 
+from habit import feed_cache, importer, metrics, services
 from habit.models import Habit
-from habit.paginators import HabitPaginator
+from habit.paginators import HabitPaginator, HabitSearchPaginator
 from habit.permissions import IsOwnerOrReadOnly
-from habit.serializers import HabitSerializer, HabitDetailSerializer
+from habit.serializers import (HabitBulkItemSerializer, HabitSerializer, HabitDetailSerializer, HabitValuesSerializer,
+                               validate_batch_actions)
+
+
+class Echo:
+    """ File-like object returning what is written to it, to stream the output of csv.writer """
+
+    def write(self, value):
+        return value
+
+
+class SparseFieldsMixin:
+    """
+    Lets GET requests keep only some habit fields with `?fields=a,b` or leave some out with `?omit=a,b`.
+    The serializer gets the selection as `fields`, and views narrow their queryset to `field_selection`.
+    """
+
+    def get_selectable_fields(self):
+        return list(self.get_serializer_class()().fields)
+
+    @cached_property
+    def field_selection(self):
+        params = self.request.query_params
+        if self.request.method != 'GET' or not ({'fields', 'omit'} & params.keys()):
+            return None
+
+        available = self.get_selectable_fields()
+        selection = available
+        for param in ('fields', 'omit'):
+            if param not in params:
+                continue
+            names = {name.strip() for name in params[param].split(',') if name.strip()}
+            unknown = names - set(available)
+            if unknown:
+                raise ValidationError({param: f'Unknown fields: {", ".join(sorted(unknown))}.'})
+            if param == 'fields':
+                selection = [name for name in selection if name in names]
+            else:
+                selection = [name for name in selection if name not in names]
+        return selection
+
+    def get_serializer(self, *args, **kwargs):
+        if self.field_selection is not None:
+            kwargs['fields'] = self.field_selection
+        return super().get_serializer(*args, **kwargs)
+
+
+class HabitValuesListMixin(SparseFieldsMixin):
+    """ Lists habits from `.values()` rows through HabitValuesSerializer, other methods keep HabitSerializer """
+
+    def get_selectable_fields(self):
+        return list(HabitValuesSerializer.columns)
+
+    def is_values_list(self):
+        return self.request.method == 'GET' and not getattr(self, 'swagger_fake_view', False)
+
+    def get_serializer_class(self):
+        if self.is_values_list():
+            return HabitValuesSerializer
+        return super().get_serializer_class()
+
+    def get_values_fields(self):
+        return HabitValuesSerializer.get_values_fields(self.field_selection)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.is_values_list():
+            return queryset.values(*self.get_values_fields())
+        return queryset
+
+
+class ConditionalGetMixin:
+    """
+    Answers GET with 304 Not Modified when the client's If-None-Match / If-Modified-Since still match
+    the validators from `get_conditional_state()`, before the queryset or serializer run.
+    """
+
+    def get_conditional_state(self):
+        """ Returns (ETag, last modification datetime), or None to answer normally """
+        return None
 
+    def get(self, request, *args, **kwargs):
+        state = self.get_conditional_state()
+        if state is None:
+            return super().get(request, *args, **kwargs)
 
-class HabitApiList(generics.ListCreateAPIView):
+        etag, last_modified = state
+        etag = quote_etag(hashlib.md5(etag.encode()).hexdigest())
+        last_modified = int(last_modified.timestamp())
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class HabitApiList(ConditionalGetMixin, HabitValuesListMixin, generics.ListCreateAPIView):
     """ View for creating a habit or listing all user's habits """
     serializer_class = HabitSerializer
     pagination_class = HabitPaginator
@@ -20,23 +131,299 @@ class HabitApiList(generics.ListCreateAPIView):
     def get_queryset(self):
         return Habit.objects.filter(user=self.request.user).order_by('pk')
 
+    def get_conditional_state(self):
+        # The user is already loaded by authentication, so a poll with nothing new costs no query.
+        # The page's body also depends on its query parameters and the user's email.
+        user = self.request.user
+        if not user.is_authenticated:
+            return None
+        return (f'{user.habits_modified_at.isoformat()}:{user.email}:{self.request.get_full_path()}',
+                user.habits_modified_at)
 
-class PublicHabitApiList(generics.ListAPIView):
+
+class PublicHabitApiList(HabitValuesListMixin, generics.ListAPIView):
     """ List of published habits """
     serializer_class = HabitSerializer
     pagination_class = HabitPaginator
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
+        if self.search_query:
+            return services.search_public_habits(self.search_query)
         return Habit.objects.filter(is_public=True).order_by('pk')
 
+    @cached_property
+    def search_query(self):
+        return self.request.query_params.get('q', '').strip()
+
+    @property
+    def paginator(self):
+        # Search results are ranked, they are paged by (rank, pk) keys instead
+        if not hasattr(self, '_paginator'):
+            self._paginator = HabitSearchPaginator() if self.search_query else self.pagination_class()
+        return self._paginator
+
+    def get_values_fields(self):
+        # The search paginator reads the rank of the last row for the next cursor
+        if self.search_query:
+            return [*super().get_values_fields(), 'rank']
+        return super().get_values_fields()
+
+    def list(self, request, *args, **kwargs):
+        if not settings.CACHE_ENABLED:
+            return super().list(request, *args, **kwargs)
+
+        # Pages are cached serialized; saving or deleting a public habit moves all keys to a new generation
+        data = feed_cache.get_or_build(feed_cache.get_page_key(request),
+                                       lambda: super(PublicHabitApiList, self).list(request, *args, **kwargs).data)
+        return Response(data)
+
+
+class PublicHabitAutocompleteApiView(generics.GenericAPIView):
+    """ Up to 10 actions of public habits starting with `?q=`, for search suggestions """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        prefix = request.query_params.get('q', '').strip()
+        return Response({'results': services.autocomplete_public_actions(prefix) if prefix else []})
+
+
+class HabitSyncApiView(SparseFieldsMixin, generics.GenericAPIView):
+    """
+    Delta sync of the user's habits: `?since=<token>` returns the habits changed and the ids of those deleted
+    since the token was issued, with a new token for the next sync. Without a token (or with one older than
+    the kept deletions) all habits are returned and `full` is true.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = HabitValuesSerializer
+
+    def get_selectable_fields(self):
+        return list(HabitValuesSerializer.columns)
+
+    def get(self, request, *args, **kwargs):
+        now = timezone.now()
+        since = None
+        token = request.query_params.get('since')
+        if token:
+            try:
+                since = services.read_sync_token(request.user, token)
+            except signing.BadSignature:
+                raise ValidationError({'since': 'Invalid sync token.'})
+
+        habits, deleted = services.get_habit_changes(request.user, since)
+        serializer = self.get_serializer(
+            habits.values(*HabitValuesSerializer.get_values_fields(self.field_selection)), many=True
+        )
+        return Response({
+            'token': services.make_sync_token(request.user, now - timedelta(seconds=settings.HABIT_SYNC_OVERLAP)),
+            'full': since is None,
+            'habits': serializer.data,
+            'deleted': deleted,
+        })
+
 
-class HabitDetailApiView(generics.RetrieveAPIView):
+class HabitBulkApiView(generics.GenericAPIView):
+    """
+    Applies a list of operations on the user's habits in one transaction:
+    [{"op": "create", "data": {...}}, {"op": "update", "id": 1, "data": {...}}, {"op": "delete", "id": 2}]
+
+    Nothing is applied unless every operation is valid. The response has a result per operation,
+    with its errors when the request is rejected.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = HabitBulkItemSerializer
+    operations = ('create', 'update', 'delete')
+
+    def post(self, request, *args, **kwargs):
+        operations = request.data
+        if not isinstance(operations, list) or not operations:
+            raise ValidationError('Expected a list of operations.')
+        if len(operations) > settings.HABIT_BULK_MAX_OPERATIONS:
+            raise ValidationError(f'At most {settings.HABIT_BULK_MAX_OPERATIONS} operations are allowed.')
+
+        # Habits to change and related habits, for all operations at once
+        habits = Habit.objects.select_related('related_habit').in_bulk(
+            {pk for operation in operations for pk in self.get_referenced_ids(operation)}
+        )
+        results = [self.validate_operation(operation, habits) for operation in operations]
+        validate_batch_actions(results)
+
+        if any('errors' in result for result in results):
+            for result in results:
+                if 'errors' not in result:
+                    result['status'] = 'valid'
+                result.pop('target', None)
+                result.pop('serializer', None)
+            return Response(results, status=status.HTTP_400_BAD_REQUEST)
+
+        # Deleted habits lose their pk, so the ids are taken first
+        target_ids = [getattr(result.get('target'), 'pk', None) for result in results]
+        created = services.apply_habit_operations(
+            request.user,
+            creates=[result['serializer'].validated_data for result in results if result['op'] == 'create'],
+            updates=[(result['target'], result['serializer'].validated_data)
+                     for result in results if result['op'] == 'update'],
+            deletes=[result['target'] for result in results if result['op'] == 'delete'],
+        )
+
+        created = iter(created)
+        for result, target_id in zip(results, target_ids):
+            result.pop('target', None)
+            result.pop('serializer', None)
+            result['id'] = next(created).pk if result['op'] == 'create' else target_id
+            result['status'] = f'{result["op"]}d'
+        return Response(results)
+
+    @staticmethod
+    def get_referenced_ids(operation):
+        if not isinstance(operation, dict):
+            return
+        data = operation.get('data')
+        for value in (operation.get('id'), data.get('related_habit') if isinstance(data, dict) else None):
+            try:
+                yield int(value)
+            except (TypeError, ValueError):
+                pass
+
+    def validate_operation(self, operation, habits):
+        """ Returns the operation's result: its target habit and serializer, or its errors """
+        if not isinstance(operation, dict) or operation.get('op') not in self.operations:
+            return {'op': None, 'errors': {'op': [f'Expected one of: {", ".join(self.operations)}.']}}
+        result = {'op': operation['op']}
+
+        target = None
+        if result['op'] != 'create':
+            try:
+                target = habits.get(int(operation.get('id')))
+            except (TypeError, ValueError):
+                pass
+            if target is None or target.user_id != self.request.user.pk:
+                result['errors'] = {'id': ['Not found.']}
+                return result
+            result['target'] = target
+            if result['op'] == 'delete':
+                return result
+
+        data = operation.get('data')
+        if not isinstance(data, dict):
+            result['errors'] = {'data': ['Expected an object.']}
+            return result
+        serializer = self.get_serializer(target, data=data, partial=target is not None,
+                                         context={**self.get_serializer_context(), 'habits': habits})
+        if serializer.is_valid():
+            result['serializer'] = serializer
+        else:
+            result['errors'] = serializer.errors
+        return result
+
+
+class HabitExportApiView(SparseFieldsMixin, generics.GenericAPIView):
+    """
+    Streams the user's habits, or all public habits with `?scope=public` for staff, as NDJSON or, with `?as=csv`,
+    as CSV. Rows are read through a server-side cursor, so memory use doesn't grow with the export.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = HabitValuesSerializer
+    content_types = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+    def get_selectable_fields(self):
+        return list(HabitValuesSerializer.columns)
+
+    def get_queryset(self):
+        if self.request.query_params.get('scope') == 'public':
+            if not self.request.user.is_staff:
+                raise PermissionDenied('Only staff can export the public habits.')
+            return Habit.objects.filter(is_public=True).order_by('pk')
+        return Habit.objects.filter(user=self.request.user).order_by('pk')
+
+    def get(self, request, *args, **kwargs):
+        output = request.query_params.get('as', 'ndjson')
+        if output not in self.content_types:
+            raise ValidationError({'as': f'Expected one of: {", ".join(self.content_types)}.'})
+
+        rows = self.get_queryset().values(*HabitValuesSerializer.get_values_fields(self.field_selection)).iterator(
+            chunk_size=settings.HABIT_EXPORT_CHUNK_SIZE
+        )
+        serializer = self.get_serializer()
+        habits = (serializer.to_representation(row) for row in rows)
+        lines = self.render_csv(habits, serializer) if output == 'csv' else self.render_ndjson(habits)
+
+        response = StreamingHttpResponse(self.buffer(lines), content_type=self.content_types[output])
+        response['Content-Disposition'] = f'attachment; filename="habits.{output}"'
+        return response
+
+    @staticmethod
+    def render_ndjson(habits):
+        for habit in habits:
+            yield json.dumps(habit, ensure_ascii=False) + '\n'
+
+    @staticmethod
+    def render_csv(habits, serializer):
+        # csv.writer only formats a row when it writes into something: it returns what the buffer got
+        writer = csv.writer(Echo())
+        field_names = [name for name, _ in serializer.plan]
+        yield writer.writerow(field_names)
+        for habit in habits:
+            yield writer.writerow([habit.get(name) for name in field_names])
+
+    @staticmethod
+    def buffer(lines, size=2 ** 16):
+        """ Joins lines into chunks of about `size` characters, so that every row isn't a separate socket write """
+        chunk, length = [], 0
+        for line in lines:
+            chunk.append(line)
+            length += len(line)
+            if length >= size:
+                yield ''.join(chunk)
+                chunk, length = [], 0
+        if chunk:
+            yield ''.join(chunk)
+
+
+class HabitImportApiView(generics.GenericAPIView):
+    """
+    Imports the user's habits from an uploaded `file`, CSV with a header row or NDJSON (by `?as=` or the file's
+    extension). The upload is parsed as it is read; rows failing validation are reported and skipped.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = HabitBulkItemSerializer
+
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': 'No file was submitted.'})
+        fmt = request.query_params.get('as') or os.path.splitext(upload.name)[1].lstrip('.').lower()
+        if fmt not in importer.FORMATS:
+            raise ValidationError({'as': f'Expected one of: {", ".join(importer.FORMATS)}.'})
+
+        report = importer.import_habits(request.user, importer.read_rows(upload, fmt))
+        return Response(report.as_dict(), status=status.HTTP_201_CREATED if report.created else status.HTTP_200_OK)
+
+
+class HabitDetailApiView(ConditionalGetMixin, SparseFieldsMixin, generics.RetrieveAPIView):
     """ Shows habit details """
     serializer_class = HabitDetailSerializer
     queryset = Habit.objects.all()
     permission_classes = [IsOwnerOrReadOnly]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.field_selection is not None:
+            # The validators need updated_at and next_due_at whatever the selection
+            return queryset.only(*self.field_selection, 'updated_at', 'next_due_at')
+        return queryset
+
+    def get_object(self):
+        # Loaded once for the validators and the response
+        if not hasattr(self, '_object'):
+            self._object = super().get_object()
+        return self._object
+
+    def get_conditional_state(self):
+        # updated_at doesn't move when a reminder is sent, but the detail shows next_due_at
+        habit = self.get_object()
+        return f'{self.request.get_full_path()}:{habit.updated_at.isoformat()}:{habit.next_due_at}', habit.updated_at
+
 
 class HabitUpdateApiView(generics.UpdateAPIView):
     """ Habit editing """
@@ -64,6 +451,10 @@ class HabitUpdateApiView(generics.UpdateAPIView):
             if time < related_habit_time:
                 raise ValidationError('New habit should be done after the related habit.')
 
+        # Reschedule the reminder when the habit's schedule changes
+        if {'time', 'frequency', 'is_learned'} & serializer.validated_data.keys():
+            serializer.validated_data['next_due_at'] = None
+
         serializer.validated_data['user'] = self.request.user
         serializer.save()
 
@@ -72,3 +463,16 @@ class HabitDestroyApiView(generics.DestroyAPIView):
     """ Habit deletion """
     queryset = Habit.objects.all()
     permission_classes = [IsOwnerOrReadOnly]
+
+
+def metrics_view(request):
+    """
+    Reminder pipeline metrics in the Prometheus text format, aggregated across worker processes.
+    Only served with `Authorization: Bearer <METRICS_TOKEN>`.
+    """
+    token = settings.METRICS_TOKEN
+    if not token or not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        response = HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:38
+
+from django.db import migrations, models
+import users.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_telegram'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='timezone',
+            field=models.CharField(default='Europe/Moscow', max_length=63, validators=[users.validators.validate_timezone], verbose_name='Time zone'),
+        ),
+    ]
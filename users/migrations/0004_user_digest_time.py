@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_user_timezone'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='digest_time',
+            field=models.TimeField(blank=True, null=True, verbose_name='Daily digest time'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:53
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_user_digest_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='habits_modified_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Habits last modified'),
+        ),
+    ]
@@ -1,5 +1,8 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils.timezone import now
+
+from users.validators import validate_timezone
 
 
 class User(AbstractUser):
@@ -10,6 +13,11 @@ class User(AbstractUser):
     username = models.CharField(max_length=50, blank=True, null=True, default='ghost', verbose_name="Username")
     country = models.CharField(max_length=50, blank=True, null=True, verbose_name='Country')
     telegram = models.CharField(max_length=150, blank=True, null=True, verbose_name="Telegram username")
+    timezone = models.CharField(max_length=63, default='Europe/Moscow', validators=[validate_timezone],
+                                verbose_name="Time zone")
+    digest_time = models.TimeField(blank=True, null=True, verbose_name="Daily digest time")
+    habits_modified_at = models.DateTimeField(default=now, editable=False,
+                                              verbose_name="Habits last modified")
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
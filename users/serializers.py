@@ -1,5 +1,7 @@
 from django.contrib.auth import get_user_model
+from django.urls import reverse
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 
 from habit.serializers import HabitSerializer
 
@@ -13,15 +15,55 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['id', 'username', 'email', 'country', 'public_habits']
 
     def get_public_habits(self, instance):
-        public_habits = instance.habits.filter(is_public=True)
+        # Filled by UserApiList's prefetch; a single profile loads them here
+        public_habits = getattr(instance, 'public_habits_list', None)
+        if public_habits is None:
+            public_habits = instance.habits.filter(is_public=True).select_related('user').order_by('pk')
         return HabitSerializer(public_habits, many=True).data
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
-    """ View full user profile """
+    """
+    View full user profile.
+
+    Embeds only the first `habits_limit` habits, with their total count and a link to the paginated
+    habit list. Write responses leave the habits out.
+    """
+    habits_limit = 10
+
     password = serializers.CharField(write_only=True, required=True)
-    habits = HabitSerializer(many=True, read_only=True)
+    habits = serializers.SerializerMethodField()
+    habits_count = serializers.SerializerMethodField()
+    habits_url = serializers.SerializerMethodField()
 
     class Meta:
         model = get_user_model()
-        fields = '__all__'
+        fields = ['id', 'email', 'password', 'username', 'first_name', 'last_name', 'country', 'telegram',
+                  'timezone', 'digest_time', 'is_active', 'is_staff', 'date_joined', 'last_login',
+                  'habits', 'habits_count', 'habits_url']
+        read_only_fields = ['is_active', 'is_staff', 'date_joined', 'last_login']
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is not None and request.method not in SAFE_METHODS:
+            fields.pop('habits')
+        return fields
+
+    def get_habits(self, instance):
+        # Filled by the profile views' prefetch
+        habits = getattr(instance, 'profile_habits', None)
+        if habits is None:
+            habits = instance.habits.order_by('pk')[:self.habits_limit]
+        return HabitSerializer(habits, many=True).data
+
+    def get_habits_count(self, instance):
+        habits_count = getattr(instance, 'habits_count', None)
+        if habits_count is None:
+            habits_count = instance.habits.count()
+        return habits_count
+
+    def get_habits_url(self, instance):
+        url = reverse('habit:habit-list-create')
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
@@ -1,9 +1,17 @@
+import zoneinfo
+from datetime import time
+from unittest import mock
+
 from django.contrib.auth import get_user_model
 from rest_framework import status
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APITestCase, APIClient
 from rest_framework_simplejwt.tokens import RefreshToken
 
+from habit.models import Habit
+from users.validators import get_timezones, validate_timezone
+
 
 class UserTestCase(APITestCase):
 
@@ -28,6 +36,34 @@ class UserTestCase(APITestCase):
         self.assertEqual(response.data['email'], self.user.email)
         self.assertTrue('habits' in response.data)
         self.assertTrue('last_name' in response.data)
+        self.assertTrue('user_permissions' not in response.data)
+
+    def test_view_own_profile_habits_slice(self):
+        """ Testing that the profile embeds a capped slice of habits with their count """
+        for number in range(15):
+            Habit.objects.create(user=self.user, action=f'habit {number}', time='10:00', place='home')
+
+        # Authentication, user with the habit count, first habits
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('users:profile', kwargs={'pk': self.user.pk}))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([habit['action'] for habit in response.data['habits']],
+                         [f'habit {number}' for number in range(10)])
+        self.assertEqual(response.data['habits_count'], 15)
+        self.assertTrue(response.data['habits_url'].endswith(reverse('habit:habit-list-create')))
+
+    def test_edit_profile_skips_habits(self):
+        """ Testing that the profile update response doesn't serialize the habits """
+        Habit.objects.create(user=self.user, action='drink water', time='08:00', place='kitchen')
+
+        response = self.client.patch(reverse('users:profile-put-patch', kwargs={'pk': self.user.pk}),
+                                     data={'country': 'Spain', 'is_staff': True})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue('habits' not in response.data)
+        self.assertEqual(response.data['habits_count'], 1)
+        self.assertFalse(response.data['is_staff'])
 
     def test_view_other_profile(self):
         """ Testing viewing someone else's profile """
@@ -44,6 +80,25 @@ class UserTestCase(APITestCase):
         self.assertTrue('public_habits' in response.data)
         self.assertTrue('habits' not in response.data)
 
+    def test_list_users_query_count(self):
+        """ Testing that the user list runs the same number of queries whatever the number of users """
+        for number in range(30):
+            user = get_user_model().objects.create(email=f'user{number}@example.com')
+            Habit.objects.create(user=user, action=f'public habit {number}', time='10:00', place='park',
+                                 is_public=True)
+            Habit.objects.create(user=user, action=f'private habit {number}', time='10:00', place='home')
+
+        # Authentication, count, page of users, their public habits
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('users:user-get'), {'page_size': 25})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 32)
+        self.assertEqual(len(response.data['results']), 25)
+        self.assertEqual([habit['action'] for habit in response.data['results'][2]['public_habits']],
+                         ['public habit 0'])
+        self.assertEqual(response.data['results'][2]['public_habits'][0]['user'], 'user0@example.com')
+
     def test_edit_own_profile(self):
         """ Testing editing your own profile """
         user_data = {
@@ -54,6 +109,36 @@ class UserTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['username'], user_data['username'])
 
+    def test_edit_timezone_reschedules_habits(self):
+        """ Testing that changing the time zone moves the user's reminders to the new local time """
+        habit = Habit.objects.create(user=self.user, action='drink water', time='08:00', place='kitchen')
+
+        response = self.client.patch(reverse('users:profile-put-patch', kwargs={'pk': self.user.pk}),
+                                     data={'timezone': 'America/New_York'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        habit.refresh_from_db()
+        self.assertEqual(timezone.localtime(habit.next_due_at, zoneinfo.ZoneInfo('America/New_York')).time(),
+                         time(8, 0))
+
+    def test_edit_invalid_timezone(self):
+        """ Testing that unknown time zones are rejected """
+        response = self.client.patch(reverse('users:profile-put-patch', kwargs={'pk': self.user.pk}),
+                                     data={'timezone': 'Mars/Olympus'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_timezones_read_once(self):
+        """ Testing that the time zone validator doesn't scan the tz database on every call """
+        get_timezones.cache_clear()
+        self.addCleanup(get_timezones.cache_clear)
+
+        with mock.patch('users.validators.zoneinfo.available_timezones', return_value={'Europe/Paris'}) as zones:
+            validate_timezone('Europe/Paris')
+            validate_timezone('Europe/Paris')
+
+        zones.assert_called_once_with()
+
     def test_edit_other_profile(self):
         """ Testing editing someone else's profile """
         user_data = {
@@ -0,0 +1,16 @@
+import zoneinfo
+from functools import lru_cache
+
+from django.core.exceptions import ValidationError
+
+
+@lru_cache(maxsize=None)
+def get_timezones():
+    """ IANA time zone names, read from the tz database once per process """
+    return zoneinfo.available_timezones()
+
+
+def validate_timezone(value):
+    """ Checks that the value is a known IANA time zone """
+    if value not in get_timezones():
+        raise ValidationError(f"'{value}' is not a valid time zone.")
@@ -1,18 +1,37 @@
 from django.contrib.auth import get_user_model
+from django.db.models import Count, Prefetch
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import generics
 from rest_framework.permissions import IsAuthenticated, AllowAny
 
+from habit.models import Habit
 from habit.permissions import IsOwnerOrReadOnly
+from habit.services import reschedule_user_habits
+from users.paginators import UserPaginator
 from users.serializers import UserSerializer, UserProfileSerializer
 
 
+def get_profile_queryset():
+    """ Users with their habit count and the first habits shown on the profile """
+    first_habits = Habit.objects.order_by('pk')[:UserProfileSerializer.habits_limit]
+    return get_user_model().objects.annotate(habits_count=Count('habits')).prefetch_related(
+        Prefetch('habits', queryset=first_habits, to_attr='profile_habits')
+    )
+
+
 class UserApiList(generics.ListAPIView):
     """ View for listing users """
     serializer_class = UserSerializer
-    queryset = get_user_model().objects.all()
     permission_classes = [IsAuthenticated]
+    pagination_class = UserPaginator
+
+    def get_queryset(self):
+        # One query for the page of users and one for all their public habits, whatever the page size
+        public_habits = Habit.objects.filter(is_public=True).order_by('pk')
+        return get_user_model().objects.order_by('pk').prefetch_related(
+            Prefetch('habits', queryset=public_habits, to_attr='public_habits_list')
+        )
 
 
 class UserRegistrationAPIView(generics.CreateAPIView):
@@ -31,7 +50,6 @@ class UserRegistrationAPIView(generics.CreateAPIView):
 
 class UserDetailApiList(generics.RetrieveAPIView):
     """ View for retrieving user details """
-    queryset = get_user_model().objects.all()
     permission_classes = [IsAuthenticated, IsOwnerOrReadOnly]
 
     @swagger_auto_schema(
@@ -47,11 +65,17 @@ class UserDetailApiList(generics.RetrieveAPIView):
     def get(self, request, *args, **kwargs):
         return super().get(request, *args, **kwargs)
 
+    def is_own_profile(self):
+        return self.kwargs.get('pk') == self.request.user.pk
+
+    def get_queryset(self):
+        if self.is_own_profile():
+            return get_profile_queryset()
+        return get_user_model().objects.all()
+
     def get_serializer_class(self):
         """ Get the serializer class based on the user """
-        user = self.get_object()
-
-        if user == self.request.user:
+        if self.is_own_profile():
             return UserProfileSerializer  # View own profile
         else:
             return UserSerializer  # View other profiles
@@ -64,12 +88,17 @@ class UserUpdateApiList(generics.UpdateAPIView):
     permission_classes = [IsAuthenticated, IsOwnerOrReadOnly]
 
     def perform_update(self, serializer):
+        old_schedule = (serializer.instance.timezone, serializer.instance.digest_time)
         user = serializer.save()
         password = self.request.data.get('password')
         if password:
             user.set_password(password)
             user.save()
 
+        # Reminders fire at the habit's (or digest) local time in the user's time zone
+        if (user.timezone, user.digest_time) != old_schedule:
+            reschedule_user_habits(user)
+
 
 class UserDestroyApiView(generics.DestroyAPIView):
     """ View for deleting a user """